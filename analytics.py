@@ -0,0 +1,53 @@
+import numpy as np
+
+# growth rates are only drawn once the cumulative count reaches this, instead of
+# from a fixed number of days in: tiny bases make for meaningless percentages
+min_base = 100
+
+
+def window_sums(m, window):
+    # sum of the last `window` columns at every column of every row of m, NaN
+    # counted as 0, and how many of those values were not NaN. One cumulative sum
+    # per matrix; the first window - 1 columns have incomplete windows.
+    missing = np.isnan(m)
+    zero = np.zeros((m.shape[0], 1))
+    sums = np.hstack([zero, np.cumsum(np.where(missing, 0, m), axis=1)])
+    counts = np.hstack([zero, np.cumsum(~missing, axis=1)])
+    lo = np.maximum(np.arange(1, m.shape[1] + 1) - window, 0)
+    return sums[:, 1:] - sums[:, lo], counts[:, 1:] - counts[:, lo]
+
+
+def rolling_mean(m, window=7):
+    # mean of the values present in each trailing window, NaN until a full window
+    sums, counts = window_sums(m, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, sums / counts, np.nan)
+    mean[:, :window - 1] = np.nan
+    return mean
+
+
+def percent_growth(cum, daily):
+    # day over day growth of a cumulative series in percent, once it reached min_base
+    prev = cum[:, :-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(prev >= min_base, 100 * daily / prev, np.nan)
+
+
+def doubling_time(cum, window=7):
+    # days the cumulative count takes to double at the growth of the last `window`
+    # days; NaN while it is not growing or still below min_base
+    ratio = np.full(cum.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio[:, window:] = np.where(cum[:, :-window] >= min_base, cum[:, window:] / cum[:, :-window], np.nan)
+        return np.where(ratio > 1, window * np.log(2) / np.log(ratio), np.nan)
+
+
+def growth_ratio(daily, window=7):
+    # new cases of the last `window` days over those of the `window` days before,
+    # a rough reproduction number: above 1 the curve is still rising
+    sums, _ = window_sums(daily, window)
+    ratio = np.full(daily.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio[:, 2 * window - 1:] = np.where(sums[:, window - 1:-window] > 0,
+                                             sums[:, 2 * window - 1:] / sums[:, window - 1:-window], np.nan)
+    return ratio
@@ -0,0 +1,100 @@
+// Applies the '<panel>_delta' updates sent by the panel callbacks: either a whole
+// figure, or a patch with the new trace data and title that is merged into the
+// figure already on the page, keeping its layout and menus. Every update resets the
+// zoom (via layout.uirevision) except keep_view patches, which only add detail to
+// the range the user zoomed into.
+// Trace x/y arrive packed (see encode_figure in data_functions.py): numbers as
+// base64 typed arrays, dates as a first day plus a count or day offsets.
+(function() {
+    var DAY = 24 * 60 * 60 * 1000;
+    var revision = 0;
+
+    function decodeArray(v) {
+        var bin = atob(v.bdata);
+        var bytes = new Uint8Array(bin.length);
+        for (var i = 0; i < bin.length; i++) {
+            bytes[i] = bin.charCodeAt(i);
+        }
+        return v.dtype === 'i4' ? new Int32Array(bytes.buffer) : new Float64Array(bytes.buffer);
+    }
+
+    function decodeDates(v) {
+        var start = Date.parse(v.start);
+        var offsets = v.offsets ? decodeArray(v.offsets) : null;
+        var n = offsets ? offsets.length : v.n;
+        var out = new Array(n);
+        for (var i = 0; i < n; i++) {
+            out[i] = new Date(start + (offsets ? offsets[i] : i) * DAY).toISOString().slice(0, 10);
+        }
+        return out;
+    }
+
+    function decode(v) {
+        if (v && v.bdata !== undefined) {
+            return decodeArray(v);
+        }
+        if (v && v.start !== undefined) {
+            return decodeDates(v);
+        }
+        return v;
+    }
+
+    function decodeTrace(trace) {
+        return Object.assign({}, trace, {x: decode(trace.x), y: decode(trace.y)});
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        figures: {
+            apply: function(update, figure) {
+                if (!update || (update.patch && !figure)) {
+                    return window.dash_clientside.no_update;
+                }
+                revision += 1;
+                if (update.figure) {
+                    return {data: update.figure.data.map(decodeTrace),
+                            layout: Object.assign({}, update.figure.layout, {uirevision: revision})};
+                }
+                var patch = update.patch;
+                var data = figure.data.map(function(trace, i) {
+                    return Object.assign({}, trace, decodeTrace(patch.data[i]));
+                });
+                var layout = Object.assign({}, figure.layout, {
+                    title: Object.assign({}, figure.layout.title, {text: patch.title})
+                });
+                if (!update.keep_view) {
+                    layout.xaxis = Object.assign({}, figure.layout.xaxis, {autorange: true});
+                    layout.yaxis = Object.assign({}, figure.layout.yaxis, {autorange: true});
+                    layout.uirevision = revision;
+                }
+                return {data: data, layout: layout};
+            },
+
+            // the world map: the whole figure once, then the values of the day picked
+            // on the time slider (see map_frame in data_functions.py)
+            mapDay: function(update, figure) {
+                if (!update || (update.frame && !figure)) {
+                    return window.dash_clientside.no_update;
+                }
+                if (update.figure) {
+                    return update.figure;
+                }
+                var frame = update.frame;
+                var vaccinated = decodeArray(frame.vaccinated);
+                var deaths = decodeArray(frame.deaths);
+                var custom = new Array(deaths.length);
+                for (var i = 0; i < deaths.length; i++) {
+                    custom[i] = [vaccinated[i], deaths[i]];
+                }
+                var trace = Object.assign({}, figure.data[0], {z: decodeArray(frame.z), customdata: custom});
+                var layout = Object.assign({}, figure.layout, {
+                    title: Object.assign({}, figure.layout.title, {text: frame.title})
+                });
+                return {data: [trace], layout: layout};
+            },
+
+            viewport: function(pathname) {
+                return window.innerWidth;
+            }
+        }
+    });
+})();
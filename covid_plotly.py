@@ -1,13 +1,20 @@
+from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import dash
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask import jsonify
 from data_functions import *
+from data_store import TimeSeriesStore, checksum, metrics
+from figure_cache import FigureCache, backend_from_env
+from fetch import fetch_all, load_state
 import numpy as np
 import time
-import wget
 import os
 
 # external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -18,130 +25,194 @@ app.title = 'COVID-19 Global Dashboard'
 
 server=app.server
 
+# rendered figures; shared by all workers on the host when CACHE_DIR is set.
+# Keys carry store.version, so new data never hits old entries.
+figure_cache = FigureCache(backend_from_env(maxsize=512), ttl=4*60*60)
+
+data_files = ['data/time_series_covid19_confirmed_global.csv',
+              'data/time_series_covid19_vaccine_doses_admin_global.csv',
+              'data/time_series_covid19_deaths_global.csv']
+data_urls = ['https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv',
+             'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables/vaccine_data/global_data/time_series_covid19_vaccine_doses_admin_global.csv',
+             'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv']
+# ETag/Last-Modified of the downloaded files, for conditional requests
+fetch_state = 'data/fetch_state.json'
+# memory-mapped snapshots of the parsed CSVs, one directory per source checksum
+store_dir = 'data/store'
+last_fetch = []
+
+
+def build_store(paths, version=None):
+    # the CSVs are streamed in chunks, see read_merged
+    frames = {m: read_merged(f) for m, f in zip(metrics, paths)}
+    # the vaccine table is the one with a Population column
+    store = TimeSeriesStore.from_frames(frames, version, read_population(paths[1]))
+    store.digests = history_digests(store, paths)
+    return store
+
+
+def history_digests(store, paths):
+    # what each source file held up to the last day store has of it, see read_history
+    return {m: read_history(f, store.dates[store.last[m]])[0] for m, f in zip(metrics, paths)}
+
+
+def extend_store(old, paths, version):
+    # old with the days each file gained since, parsing only those; None when a file
+    # changed anywhere else (a revised day, a row added or removed), so it needs a rebuild
+    frames = {}
+    for m, f in zip(metrics, paths):
+        digest, new = read_history(f, old.dates[old.last[m]])
+        if digest is None or digest != old.digests.get(m):
+            return None
+        if new:
+            frames[m] = read_merged(f, new)
+    new = old.extend(frames, version)
+    if new is not None:
+        new.digests = history_digests(new, paths)
+    return new
+
+
+def read_store():
+    # memory-map the binary snapshot of the CSVs on disk, parsing them only when
+    # no process saved one for these exact files yet
+    version = checksum(data_files)
+    store = TimeSeriesStore.load(store_dir, version)
+    if store is None:
+        store = build_store(data_files, version)
+        store.save(store_dir)
+    return store
+
+
+def refresh_store(old):
+    # parse only the days added upstream since old was built; everything again when
+    # upstream revised what is already loaded
+    version = checksum(data_files)
+    if version == old.version:
+        return old
+
+    new = TimeSeriesStore.load(store_dir, version)
+    if new is None:
+        new = extend_store(old, data_files, version) or build_store(data_files, version)
+        new.save(store_dir)
+    return new
+
+
+# everything the callbacks read for one version of the data. A new one is built off
+# to the side and published by rebinding `snapshot`, so readers never see a mix.
+Snapshot = namedtuple('Snapshot', ['store', 'ranking', 'summary', 'table'])
+
+# the cards and the data age banner of a snapshot, already formatted: all that the
+# page polls for (see update_summary). updated is when upstream last changed the data.
+Summary = namedtuple('Summary', ['version', 'as_of', 'updated', 'confirmed', 'change_confirmed', 'vaccinated',
+                                 'change_vaccinated', 'deaths', 'change_deaths', 'cases_per_million'])
+
+
+def data_updated(store):
+    # the newest Last-Modified upstream sent for the files, else the end (UTC) of the
+    # last day the figures cover. Not the files' mtime: that is when this host
+    # downloaded or checked them out.
+    state = load_state(fetch_state)
+    stamps = []
+    for url in data_urls:
+        try:
+            stamps.append(parsedate_to_datetime(state[url]['last_modified']).timestamp())
+        except (KeyError, TypeError, ValueError):
+            pass
+    if stamps:
+        return max(stamps)
+    day = max(store.dates[store.last[m]] for m in metrics)
+    return datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp() + 24*60*60
+
+
+def make_snapshot(store):
+    # each source up to the last day it reported, they can end on different days
+    # (total, change since the day before) per metric as card text
+    cards = []
+    for m in metrics:
+        totals = store.totals[m][:store.last[m] + 1]
+        cards += [f'{int(totals[-1]):,}', f'{int(totals[-1] - totals[-2]):+,}']
+    # over the countries whose population is known
+    known = ~np.isnan(store.population)
+    cases_per_million = 1e6 * np.nansum(store.day('Confirmed')[known]) / store.population[known].sum()
+
+    n = -1
+    ranked = ranking_frame(store)
+    ranked = ranked.sort_values(by='Confirmed', ascending=False).iloc[:n]
+    table = dbc.Table.from_dataframe(ranked[['Country'] + metrics].iloc[:-12], dark=True, bordered=True,
+                                     hover=True, responsive=True, size='sm',
+                                     className='container', style={'margin': 'auto'})
+
+    # the day the figures are for, per source when they do not agree
+    days = {case_dict[c]: store.dates[store.last[m]] for c, m in enumerate(metrics)}
+    as_of = ', '.join(f'{name} {day}' for name, day in days.items()) if len(set(days.values())) > 1 \
+        else days['confirmed']
+
+    summary = Summary(store.version, as_of, data_updated(store), *cards, f'{cases_per_million:,.0f}')
+
+    return Snapshot(store, Ranking(ranked, ranked.columns[1:]), summary, table)
+
+
+def fetch_data(sources):
+    global last_fetch
+    last_fetch = fetch_all(sources, fetch_state)
+    return last_fetch
 
-def define_variables(df_confirmed, df_vaccinated, df_deaths):
-    global df_vac
-    global df_con
-    global df_dea
-    global df_act
-    global confirmed
-    global vaccinated
-    global deaths
-    global total_confirmed
-    global total_vaccinated
-    global total_deaths
-    global change_confirmed
-    global change_vaccinated
-    global change_deaths
-    global recovery_rate
-    global mortality_rate
-    global cases_per_million
-    df_confirmed.drop(['Province/State', 'Lat', 'Long'], axis=1, inplace=True)
-    df_confirmed.rename(columns={'Country/Region': 'Country'}, inplace=True)
-    df_vaccinated.drop(['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Province_State',
-                        'Lat', 'Long_', 'Combined_Key', 'Population'], axis=1, inplace=True)
-    df_vaccinated.rename(columns={'Country_Region': 'Country'}, inplace=True)
-    df_deaths.drop(['Province/State', 'Lat', 'Long'], axis=1, inplace=True)
-    df_deaths.rename(columns={'Country/Region': 'Country'}, inplace=True)
-    df_vac = merge_countries(df_vaccinated).sort_values(by='Country')  # .drop(['12/13/20'], axis=1)
-    df_con = merge_countries(df_confirmed).sort_values(by='Country')  # .drop(['12/13/20'], axis=1)
-    df_dea = merge_countries(df_deaths).sort_values(by='Country')  # .drop(['12/13/20'], axis=1)
-    df_con.columns = [df_con.columns[0]] + [fix_date(x) for x in df_con.columns[1:]]
-    df_dea.columns = [df_dea.columns[0]] + [fix_date(x) for x in df_dea.columns[1:]]
-
-    confirmed = date_wise(df_con.sum(axis=0))
-    vaccinated = date_wise(df_vac.sum(axis=0), flag=1)
-    deaths = date_wise(df_dea.sum(axis=0))
-    total_confirmed = confirmed.Value.iloc[-1]
-    total_vaccinated = vaccinated.Value.iloc[-1]
-    total_deaths = deaths.Value.iloc[-1]
-    change_confirmed = confirmed.Value.iloc[-1] - confirmed.Value.iloc[-2]
-    change_vaccinated = vaccinated.Value.iloc[-1] - vaccinated.Value.iloc[-2]
-    change_deaths = deaths.Value.iloc[-1] - deaths.Value.iloc[-2]
-
-    if change_confirmed >= 0:
-        change_confirmed = f'+{change_confirmed:,}'
-    else:
-        change_confirmed = f'-{-change_confirmed:,}'
-    if change_vaccinated >= 0:
-        change_vaccinated = f'+{int(change_vaccinated):,}'
-    else:
-        change_vaccinated = f'-{-int(change_vaccinated):,}'
-    if change_deaths >= 0:
-        change_deaths = f'+{change_deaths:,}'
-    else:
-        change_deaths = f'-{-change_deaths:,}'
-    recovery_rate = 100 * total_vaccinated / (total_confirmed)
-    mortality_rate = 100 * total_deaths / (total_confirmed)
-    cases_per_million = 1e6 * total_confirmed / 7796127694
 
 # getting data periodically
 def update_data(period=4):
+  global snapshot
   while True:
-    os.remove('data/time_series_covid19_confirmed_global.csv')
-    wget.download('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv','./data')
-    global df_confirmed
-    df_confirmed = pd.read_csv('data/time_series_covid19_confirmed_global.csv')
-
-    os.remove('data/time_series_covid19_recovered_global.csv')
-    wget.download('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv','./data')
-    global df_recovered
-    df_recovered = pd.read_csv('data/time_series_covid19_recovered_global.csv')
-
-    os.remove('data/time_series_covid19_deaths_global.csv')
-    wget.download('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv','./data')
-    global df_deaths
-    df_deaths = pd.read_csv('data/time_series_covid19_deaths_global.csv')
+    try:
+        fetch_data(list(zip(data_urls, data_files)))
+        # the files are shared by every worker: another one may have downloaded them
+        # (this one then gets 304s), or an earlier refresh failed after the download
+        if checksum(data_files) != snapshot.store.version:
+            snapshot = make_snapshot(refresh_store(snapshot.store))
+            warm_up()
+    except Exception as e:
+        print(f'updating data failed, keeping the current snapshot: {e}')
     time.sleep(period*60*60)
-    # print('updating data...')
-    define_variables(df_confirmed, df_recovered, df_deaths)
 
 
-if 'time_series_covid19_confirmed_global.csv' not in os.listdir('./data'):
-    wget.download('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv', './data')
-if 'time_series_covid19_vaccine_doses_admin_global.csv' not in os.listdir('./data'):
-    wget.download('https://raw.githubusercontent.com/govex/COVID-19/master/data_tables/vaccine_data/global_data/time_series_covid19_vaccine_doses_admin_global.csv', './data')
-if 'time_series_covid19_deaths_global.csv' not in os.listdir('./data'):
-    wget.download('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv', './data')
+missing = [(url, path) for url, path in zip(data_urls, data_files) if not os.path.exists(path)]
+if missing:
+    fetch_data(missing)
 
 # importing data
-df_confirmed = pd.read_csv('data/time_series_covid19_confirmed_global.csv')
-df_vaccinated = pd.read_csv('data/time_series_covid19_vaccine_doses_admin_global.csv')
-df_deaths = pd.read_csv('data/time_series_covid19_deaths_global.csv')
-define_variables(df_confirmed, df_vaccinated, df_deaths)
+snapshot = make_snapshot(read_store())
 
 
-# cards
+# cards, filled in by update_summary
 card_1 = dbc.Card([
         # dbc.CardImg(src="assets/images/confirm.png", top=True),
         dbc.CardBody([
                 html.H6("Confirmed", className='card_title'),
-                html.H5(f"{change_confirmed}", className='card_changed'),
-                html.H5(f"{total_confirmed:,}", className='card_value')
+                html.H5(id='card_confirmed_change', className='card_changed'),
+                html.H5(id='card_confirmed', className='card_value')
                 ], className='card_1_body')], className='card_1')
 
 card_2 = dbc.Card([
         # dbc.CardImg(src="assets/images/recovered.png", top=True),
         dbc.CardBody([
                 html.H6("Vaccinated", className='card_title'),
-                html.H5(f"{change_vaccinated}", className='card_changed'),
-                html.H5(f"{change_vaccinated}", className='card_value')
+                html.H5(id='card_vaccinated_change', className='card_changed'),
+                html.H5(id='card_vaccinated', className='card_value')
                 ], className='card_2_body')], className='card_2')
 
 card_3 = dbc.Card([
         # dbc.CardImg(src="assets/images/deceased.png", top=True),
         dbc.CardBody([
                 html.H6("Deceased", className='card_title'),
-                html.H5(f"{change_deaths}", className='card_changed'),
-                html.H5(f"{total_deaths:,}", className='card_value')
+                html.H5(id='card_deaths_change', className='card_changed'),
+                html.H5(id='card_deaths', className='card_value')
                 ], className='card_3_body')], className='card_3')
 
 # card_4 = dbc.Card([
 #         # dbc.CardImg(src="assets/images/recovered.png", top=True),
 #         dbc.CardBody([
 #                 html.H6("Recovered", className='card_title'),
-#                 html.H5(f"{change_vaccinated}", className='card_changed'),
-#                 html.H5(f"{change_vaccinated}", className='card_value')
+#                 html.H5(f"{snapshot.change_vaccinated}", className='card_changed'),
+#                 html.H5(f"{snapshot.change_vaccinated}", className='card_value')
 #                 ], className='card_2_body')], className='card_4')
 
 ##########################################
@@ -153,54 +224,105 @@ files = {'covid': 'data/covid_19_data.csv',
          'global_deaths': 'data/time_series_covid_19_deaths.csv',
          'global_vaccinated': 'data/time_series_covid19_vaccine_doses_admin_global.csv'}
 
-n = -1
-df_top = for_map(df_con, df_vac, df_dea, flag='top')
-countries = df_top['Country'].values
+countries = for_map(snapshot.store)['Country'].values
 countries = np.append(countries, 'Global')
-df_top = df_top.sort_values(by='Confirmed', ascending=False).iloc[:n]
 
 ################ world-map #################
-df_map = for_map(df_con, df_vac, df_dea)
-fig_map = create_map(df_map)
-fig_map = html.Div(dcc.Graph(figure=fig_map, className='fig_map'), style={'padding':'1.25rem'})
+# the map and sunbursts are heavy: the layout ships placeholders and the figures are
+# built on the first request (or by warm_up) and memoized in figure_cache
+def map_figure(store, i=None, norm='total'):
+    # the map on date column i, by default the last day with confirmed counts
+    i = store.last['Confirmed'] if i is None else i
+    return figure_cache.get_or_build(('map', store.version, i, norm), lambda: create_map(map_data(store, i, norm)))
+
+
+# time slider under the map: moving it fetches just that day's values (map_frame),
+# which figures.mapDay (assets/figure_patch.js) writes into the figure on the page
+map_slider = dcc.Slider(id='map_day', min=0, max=0, step=1, updatemode='mouseup')
+map_norm = dbc.Select(id='map_norm', options=[{"label": "confirmed cases", "value": 'total'},
+                                              {"label": "confirmed cases per 100k people", "value": 'per100k'},
+                                              {"label": "confirmed cases per person", "value": 'capita'}],
+                      value='total')
+
+fig_map = html.Div([dcc.Loading([dcc.Graph(id='fig_map', figure=placeholder(600), className='fig_map'),
+                                 dcc.Store(id='fig_map_delta')]),
+                    dcc.Store(id='fig_map_key'), dcc.Store(id='map_version'), map_slider, map_norm],
+                   style={'padding':'1.25rem'})
+
+
+def slider_marks(store):
+    # a mark at the start of every quarter
+    return {i: d[:7] for i, d in enumerate(store.dates) if d[5:] in ('01-01', '04-01', '07-01', '10-01')}
 
 ################ sunburst plot #############
-df_continent = pd.read_csv('https://raw.githubusercontent.com/dbouquin/IS_608/master/NanosatDB_munging/Countries-Continents.csv')
-df_continent.replace('Burkina', 'Burkina Faso', inplace=True)
-df_continent.replace('Burma (Myanmar)', 'Burma', inplace=True)
-df_continent.replace('Congo', 'Congo (Brazzaville)', inplace=True)
-df_continent.replace('Congo, Democratic Republic of', 'Congo (Kinshasa)', inplace=True)
-df_continent.replace('Russian Federation', 'Russia', inplace=True)
-
-new = pd.DataFrame([['Africa', 'Congo (Brazzaville)'],
-                    ['Africa', 'Congo (Kinshasa)'],
-                    ['Europe', 'Czechia'],
-                    ['Asia', 'Taiwan*'],
-                    ['Africa', 'Western Sahara']], columns=df_continent.columns)
-df_continent = df_continent.append(new)
-df_sunburst = for_map(df_con, df_vac, df_dea, flag='top')
-df_sunburst = pd.merge(df_continent, df_sunburst, on='Country')
-df_sunburst.replace(0, np.nan, inplace=True)
-df_sunburst.dropna(inplace=True)
-fig_sunburst_confirmed = create_sunburst(df_sunburst, 'Confirmed')
-fig_sunburst_vaccinated = create_sunburst(df_sunburst, 'vaccinated')
-fig_sunburst_deaths = create_sunburst(df_sunburst, 'Deaths')
-
-fig_sunburst_confirmed = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(figure=fig_sunburst_confirmed))),
+# continent mapping bundled with the app (see continent_file); its checksum is part of
+# the cache key so editing it invalidates the cached sunbursts
+continent_version = checksum([continent_file])
+
+
+def sunburst_figures(store):
+    def build():
+        tree = hierarchy(for_map(store))
+        return [create_sunburst(tree, feature) for feature in metrics]
+    return figure_cache.get_or_compute(('sunburst', store.version, continent_version), build)
+
+
+fig_sunburst_confirmed = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Loading(dcc.Graph(id='fig_sunburst_confirmed', figure=placeholder())))),
                                              className='figure_confirmed'), className='figure_rows'))
 
-fig_sunburst_vaccinated = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(figure=fig_sunburst_vaccinated))),
+fig_sunburst_vaccinated = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Loading(dcc.Graph(id='fig_sunburst_vaccinated', figure=placeholder())))),
                                              className='figure_recovered'), className='figure_rows'))
 
-fig_sunburst_deaths = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(figure=fig_sunburst_deaths))),
+fig_sunburst_deaths = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Loading(dcc.Graph(id='fig_sunburst_deaths', figure=placeholder())))),
                                             className='figure_deceased'), className='figure_rows'))
 
+
+# the slider's days on page load and, on open pages, whenever update_data published
+# new data (checked every summary_interval); map_version then makes load_map send
+# the new map even if the slider stays where it was
+@app.callback([Output('map_day', 'min'), Output('map_day', 'max'), Output('map_day', 'marks'),
+               Output('map_day', 'value'), Output('map_version', 'data')],
+              [Input('url', 'pathname'), Input('summary_interval', 'n_intervals')], [State('map_version', 'data')])
+def load_slider(pathname, n_intervals, version):
+    store = snapshot.store
+    if version == store.version:
+        raise PreventUpdate
+    last = store.last['Confirmed']
+    return store.first['Confirmed'], last, slider_marks(store), last, store.version
+
+
+@app.callback([Output('fig_map_delta', 'data'), Output('fig_map_key', 'data')],
+              [Input('map_day', 'value'), Input('map_norm', 'value'), Input('map_version', 'data')],
+              [State('fig_map_key', 'data')])
+def load_map(i, norm, version, key):
+    # the whole map the first time, after a data refresh and in other units, then
+    # one day at a time
+    store = snapshot.store
+    if i is None or i > store.last['Confirmed']:
+        i = store.last['Confirmed']
+    norm = norm or 'total'
+    new_key = [store.version, norm, i]
+    if new_key == key:
+        raise PreventUpdate
+    if key is None or key[:2] != new_key[:2]:
+        return {'figure': map_figure(store, i, norm)}, new_key
+    # one row of by_date and some base64: cheaper to build than to keep in the shared cache
+    return {'frame': map_frame(store, i, norm)}, new_key
+
+
+app.clientside_callback(ClientsideFunction(namespace='figures', function_name='mapDay'),
+                        Output('fig_map', 'figure'), [Input('fig_map_delta', 'data')], [State('fig_map', 'figure')])
+
+
+@app.callback([Output('fig_sunburst_confirmed', 'figure'), Output('fig_sunburst_vaccinated', 'figure'),
+               Output('fig_sunburst_deaths', 'figure')], [Input('url', 'pathname')])
+def load_sunbursts(pathname):
+    return sunburst_figures(snapshot.store)
+
 ############################################
-# table card
-table_card = dbc.Card([
-                dbc.Table.from_dataframe(df_top.iloc[:-12], dark=True, bordered=True,
-                                 hover=True, responsive=True, size='sm',
-                                 className='container', style={'margin': 'auto'})], className='table_card')
+# table card, filled in by update_summary
+table_card = dbc.Card(id='table_card', className='table_card')
+table_version = dcc.Store(id='table_version')
 
 ############################################
 #card container row
@@ -239,9 +361,24 @@ dropdown_global = dbc.Card(dbc.CardBody(dbc.Row(dbc.Col(
                                               {"label": "vaccinated", "value": 'vaccinated'},
                                               {"label": "deceased", "value": 'Deaths'}], value='Confirmed'),
 
-                                dbc.InputGroupAddon("cases!", addon_type="prepend", className='addon_text'),
+                                dbc.InputGroupAddon("cases", addon_type="prepend", className='addon_text'),
+
+                                dbc.Select(id="_norm",
+                                     options=[{"label": "in total", "value": 'total'},
+                                              {"label": "per 100k people", "value": 'per100k'},
+                                              {"label": "per person", "value": 'capita'}], value='total'),
                                  ], className='input_group'))), className='tab_global_card'), className='tab_global_card')
 
+dropdown_compare = dbc.Card(dbc.CardBody(dbc.Row([
+                            dbc.Col(dcc.Dropdown(id='_compare', multi=True, value=['US', 'India', 'Brazil'],
+                                                 options=[{'label': c, 'value': c} for c in countries if c != 'Global'],
+                                                 placeholder="Pick countries...")),
+                            dbc.Col(dbc.InputGroup([
+                                dbc.InputGroupAddon("Align at case", addon_type="prepend", className='addon_text'),
+                                dbc.Input(placeholder="off", type="number", min=1, step=1, id='_align'),
+                                ], className='input_group')),
+                            ]), className='tab_global'), className='tab_global')
+
 #############################################
 # tabs
 tabs = dbc.Row(dbc.Col([
@@ -249,6 +386,7 @@ tabs = dbc.Row(dbc.Col([
         [
         dbc.Tab(dropdown_global, label="Global data", className='tab_global', tab_id="tab-1"),
         dbc.Tab(dropdown_country, label="Country wise data", className='tab_country', tab_id="tab-2"),
+        dbc.Tab(dropdown_compare, label="Compare countries", className='tab_country', tab_id="tab-3"),
         ], id="_tabs", active_tab="tab-1"), className='tabs_card'),
     dbc.Button("Get results", color='#AAA', size="sm", className="button", block=True, id='button'),
                         ], className='tabs_column'),
@@ -286,7 +424,17 @@ fig_recovered_daily = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(i
 fig_deceased_daily = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(id='fig_deceased_daily'))),
                                              className='figure_deceased'), className='figure_rows'))
 
-# rate
+# rate, or one of the other rate_modes picked here
+rate_mode = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(
+                        dbc.InputGroup([
+                            dbc.InputGroupAddon("Growth charts show", addon_type="prepend", className='addon_text'),
+                            dbc.Select(id='_rate_mode',
+                                       options=[{"label": "daily growth (%)", "value": 'rate'},
+                                                {"label": "doubling time (days)", "value": 'doubling'},
+                                                {"label": "new cases vs. the week before", "value": 'growth'}],
+                                       value='rate'),
+                            ], className='input_group')), className='tab_global_card'), className='figure_rows'))
+
 # fig_global_confirmed_rate = confirm_rate(df_con, 0)
 fig_confirmed_rate = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(id='fig_confirmed_rate'))),
                                              className='figure_confirmed'), className='figure_rows'))
@@ -300,59 +448,217 @@ fig_deceased_rate = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody(html.Div(dcc.Graph(id=
                                             className='figure_deceased'), className='figure_rows'))
 
 
-###### default output ######
-[f1,f2,f3,f4,f5,f6,f7,f8,f9,f10] = [
-         create_global_bar(df_top),
-         confirm_cdf(df_con, c=0), confirm_cdf(df_vac, c=1),
-             confirm_cdf(df_dea, c=2),
+###### figure cache ######
+@server.route('/cache-stats')
+def cache_stats():
+    return jsonify(figure_cache.stats())
 
-         confirm_daily(df_con, c=0), confirm_daily(df_vac, c=1),
-             confirm_daily(df_dea, c=2),
 
-         confirm_rate(df_con, c=0), confirm_rate(df_vac, c=1),
-             confirm_rate(df_dea, c=2)]
+@server.route('/fetch-stats')
+def fetch_stats():
+    return jsonify(last_fetch)
 
-# https://community.plotly.com/t/is-there-a-way-to-only-update-on-a-button-press-for-apps-where-updates-are-slow/4679/7
 
-@app.callback([
-    Output("fig_bar", "figure"),
-    Output("fig_confirmed_cdf", "figure"), Output("fig_recovered_cdf", "figure"),
-        Output("fig_deceased_cdf", "figure"),
-    Output("fig_confirmed_daily", "figure"), Output("fig_recovered_daily", "figure"),
-        Output("fig_deceased_daily", "figure"),
-    Output("fig_confirmed_rate", "figure"), Output("fig_recovered_rate", "figure"),
-        Output("fig_deceased_rate", "figure")],
-    [Input('button', 'n_clicks')],
-    state = [State("_no_of_cntry", "value"), State("_hgh_or_lw", "value"), State("_feature", "value"),
-     State("_cntry_name", "value"), State("_tabs", "active_tab")])
+@server.route('/summary')
+def summary_stats():
+    return jsonify(snapshot.summary._asdict())
 
-def output_text(n_clicks, _no_of_cntry, _hgh_or_lw, _feature, _cntry_name, _tabs):
 
-    if _tabs == 'tab-1':
-        _cntry_name = '#'
+def bar_inputs(no_of_cntry, hgh_or_lw, feature, cntry_name, norm):
+    # the bar's ranking inputs are ignored when a single country is shown, a list of
+    # countries being compared keeps only the units
+    if isinstance(cntry_name, list):
+        return None, 'highest', 'Confirmed', cntry_name, norm
+    if cntry_name != '#':
+        return no_of_cntry, 'highest', 'Confirmed', cntry_name, 'total'
+    return no_of_cntry, hgh_or_lw, feature, cntry_name, norm
+
 
-    output = [f1, f2, f3, f4, f5,
-              f6, f7, f8, f9, f10]
+def bar_figure(snap, no_of_cntry=10, hgh_or_lw='highest', feature='Confirmed', cntry_name='#', norm='total'):
+    no_of_cntry, hgh_or_lw, feature, cntry_name, norm = bar_inputs(no_of_cntry, hgh_or_lw, feature, cntry_name, norm)
+    if isinstance(cntry_name, list):
+        cntry_name = tuple(cntry_name)
+    return figure_cache.get_or_compute(('bar', snap.store.version, no_of_cntry, hgh_or_lw, feature, cntry_name, norm),
+                                     lambda: encode_figure(create_global_bar(snap.ranking, no_of_cntry, feature, hgh_or_lw,
+                                                                             cntry_name, norm)))
 
-    # print('.. clicks ---->>>', n_clicks)
-    if n_clicks:
-        output = [create_global_bar(df_top, _no_of_cntry, _feature, _hgh_or_lw, _cntry_name),
-                  confirm_cdf(df_con, c=0, cntry_name=_cntry_name),
-                  confirm_cdf(df_vac, c=1, cntry_name=_cntry_name),
-                  confirm_cdf(df_dea, c=2, cntry_name=_cntry_name),
 
-                  confirm_daily(df_con, c=0, cntry_name=_cntry_name),
-                  confirm_daily(df_vac, c=1, cntry_name=_cntry_name),
-                  confirm_daily(df_dea, c=2, cntry_name=_cntry_name),
+def chart_figure(snap, chart, c, cntry_name='#', points=None, window=None):
+    def build():
+        return encode_figure(chart(snap.store, c=c, cntry_name=cntry_name, points=points, window=window))
+    if window is not None:
+        # detail for the exact range someone zoomed to is rarely asked for twice; caching
+        # it would only push the shared entries (map, sunbursts, default panels) out
+        return build()
+    return figure_cache.get_or_compute((chart.__name__, snap.store.version, c, cntry_name, points), build)
 
-                  confirm_rate(df_con, c=0, cntry_name=_cntry_name),
-                  confirm_rate(df_vac, c=1, cntry_name=_cntry_name),
-                  confirm_rate(df_dea, c=2, cntry_name=_cntry_name)]
 
-        return output
+# the line each chart is compared on; daily bars become their 7-day average
+compare_kinds = {'confirm_cdf': 'cdf', 'confirm_daily': 'avg', 'confirm_rate': 'rate',
+                 'confirm_doubling': 'doubling', 'confirm_growth': 'growth'}
+# the store chart each panel chart is drawn from (the daily average has the same days)
+chart_kinds = dict(compare_kinds, confirm_daily='daily')
 
-    elif n_clicks==None:
-        return output
+
+def compare_figure(snap, chart, c, countries, align=None):
+    # a few hundred points per country, so no level of detail here
+    key = ('compare', chart.__name__, snap.store.version, c, tuple(countries), align)
+    return figure_cache.get_or_compute(key, lambda: encode_figure(compare_chart(snap.store, c, compare_kinds[chart.__name__],
+                                                                                countries, align)))
+
+
+# Level of detail: time series longer than the chart is wide in pixels are thinned
+# to one point per pixel (see TimeSeriesStore.chart). The chart column is 8 of the
+# 12 grid columns; widths are rounded so similar screens share cache entries, and
+# capped at the number of days, so every screen wide enough to show all of them
+# shares the entries warm_up builds.
+default_points = 800
+
+
+def lod_points(width, store):
+    points = default_points if not width else int(min(max(width * 2 // 3, 300), 2000)) // 100 * 100
+    return min(points, len(store.dates))
+
+
+def visible_window(relayout):
+    # [first, last] ISO day of a zoom or range slider drag, None when the x axis went
+    # back to showing everything; PreventUpdate for relayouts that leave x alone
+    relayout = relayout or {}
+    if 'xaxis.range' in relayout:
+        lo, hi = relayout['xaxis.range']
+    elif 'xaxis.range[0]' in relayout:
+        lo, hi = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.autorange' in relayout:
+        return None
+    else:
+        raise PreventUpdate
+    return [str(lo)[:10], str(hi)[:10]]
+
+
+def figures():
+    # default output of every panel
+    snap = snapshot
+    return [bar_figure(snap)] + [chart_figure(snap, chart, c, points=lod_points(None, snap.store))
+                                 for _, chart, c in chart_panels]
+
+
+# https://community.plotly.com/t/is-there-a-way-to-only-update-on-a-button-press-for-apps-where-updates-are-slow/4679/7
+
+# Every panel has its own callback, so the browser requests them in parallel and each
+# only depends on the inputs it uses. The '<panel>_key' store remembers what a panel
+# shows; a click that would not change it is skipped with PreventUpdate. Callbacks
+# write to '<panel>_delta' and the clientside figures.apply (assets/figure_patch.js)
+# turns that into the graph's figure.
+chart_panels = [('fig_confirmed_cdf', confirm_cdf, 0), ('fig_recovered_cdf', confirm_cdf, 1),
+                ('fig_deceased_cdf', confirm_cdf, 2),
+                ('fig_confirmed_daily', confirm_daily, 0), ('fig_recovered_daily', confirm_daily, 1),
+                ('fig_deceased_daily', confirm_daily, 2),
+                ('fig_confirmed_rate', confirm_rate, 0), ('fig_recovered_rate', confirm_rate, 1),
+                ('fig_deceased_rate', confirm_rate, 2)]
+panel_ids = ['fig_bar'] + [p for p, _, _ in chart_panels]
+panel_keys = [dcc.Store(id=f'{panel}_{store}') for panel in panel_ids for store in ['key', 'delta']]
+# browser window width, for lod_points
+viewport = dcc.Store(id='viewport')
+
+
+def panel_update(fig, key, new_key, keep_view=False):
+    # the whole figure the first time a panel is drawn or when it switches skeleton
+    # (the key's last item), afterwards only the parts fill() changed. keep_view
+    # leaves the user's zoom alone (more detail for the range they zoomed into).
+    if key is not None and key[-1] == new_key[-1]:
+        return {'patch': figure_delta(fig), 'keep_view': keep_view}
+    return {'figure': fig}
+
+
+for panel in panel_ids:
+    app.clientside_callback(ClientsideFunction(namespace='figures', function_name='apply'),
+                            Output(panel, 'figure'), [Input(f'{panel}_delta', 'data')], [State(panel, 'figure')])
+
+app.clientside_callback(ClientsideFunction(namespace='figures', function_name='viewport'),
+                        Output('viewport', 'data'), [Input('url', 'pathname')])
+
+
+@app.callback([Output('fig_bar_delta', 'data'), Output('fig_bar_key', 'data')],
+    [Input('button', 'n_clicks')],
+    state = [State("_no_of_cntry", "value"), State("_hgh_or_lw", "value"), State("_feature", "value"),
+     State("_norm", "value"), State("_cntry_name", "value"), State("_compare", "value"), State("_tabs", "active_tab"),
+     State('fig_bar_key', 'data')])
+def update_bar(n_clicks, _no_of_cntry, _hgh_or_lw, _feature, _norm, _cntry_name, _compare, _tabs, key):
+    snap = snapshot
+    if not n_clicks:
+        _no_of_cntry, _hgh_or_lw, _feature, _norm, _cntry_name = 10, 'highest', 'Confirmed', 'total', '#'
+    elif _tabs == 'tab-1' or (_tabs == 'tab-3' and not _compare):
+        _cntry_name = '#'
+    elif _tabs == 'tab-3':
+        _cntry_name = _compare
+    # the bar_skeleton create_global_bar draws with: compared countries are stacked like the top N
+    skeleton = 'single' if isinstance(_cntry_name, str) and _cntry_name != '#' else 'top'
+    # only the inputs the figure depends on, so changing an ignored one redraws nothing
+    new_key = [snap.store.version, *bar_inputs(_no_of_cntry, _hgh_or_lw, _feature, _cntry_name, _norm), skeleton]
+    if new_key == key:
+        raise PreventUpdate
+    return panel_update(bar_figure(snap, _no_of_cntry, _hgh_or_lw, _feature, _cntry_name, _norm), key, new_key), new_key
+
+
+# what the rate panels can show instead of daily growth, picked with _rate_mode
+rate_modes = {'rate': confirm_rate, 'doubling': confirm_doubling, 'growth': confirm_growth}
+
+
+def register_chart_panel(panel, chart, c, modes=None):
+    # also redrawn when the user zooms: the zoomed range then gets its full detail.
+    # Panels with modes also follow _rate_mode, showing modes[mode] instead of chart.
+    # Not called on page load: the first draw waits for the viewport width, instead of
+    # drawing at default_points and again once the width is known.
+    inputs = [Input('button', 'n_clicks'), Input(panel, 'relayoutData'), Input('viewport', 'data')]
+    if modes:
+        inputs.append(Input('_rate_mode', 'value'))
+
+    @app.callback([Output(f'{panel}_delta', 'data'), Output(f'{panel}_key', 'data')], inputs,
+        state = [State("_cntry_name", "value"), State("_compare", "value"), State("_align", "value"),
+                 State("_tabs", "active_tab"), State(f'{panel}_key', 'data')], prevent_initial_call=True)
+    def update_panel(n_clicks, relayout, width, *args):
+        *mode, _cntry_name, _compare, _align, _tabs, key = args
+        snap = snapshot
+        shown = modes.get(mode[0], chart) if modes else chart
+        trigger = dash.callback_context.triggered[0]['prop_id']
+        zoomed = key is not None and trigger == f'{panel}.relayoutData'
+        points = lod_points(width, snap.store)
+        if zoomed:
+            # compared countries are drawn in full, zooming needs nothing new
+            if isinstance(key[1], list):
+                raise PreventUpdate
+            window = visible_window(relayout)
+            _cntry_name = key[1]
+            # neither does a series short enough to be drawn with every point
+            _, y = snap.store.chart(chart_kinds[shown.__name__], metrics[c], _cntry_name)
+            if points >= len(y):
+                raise PreventUpdate
+        elif key is not None and trigger == '_rate_mode.value':
+            # same country, other chart
+            window = None
+            _cntry_name = key[1]
+        else:
+            window = None
+            if not n_clicks or _tabs == 'tab-1' or (_tabs == 'tab-3' and not _compare):
+                _cntry_name = '#'
+            elif _tabs == 'tab-3':
+                # [align, *countries]
+                _cntry_name = [_align] + _compare
+        new_key = [snap.store.version, _cntry_name, points, window, shown.__name__]
+        if isinstance(_cntry_name, list):
+            # a comparison has its own traces, names and axis title: always a whole figure
+            new_key[-1] = [shown.__name__] + _cntry_name
+            if new_key == key:
+                raise PreventUpdate
+            return panel_update(compare_figure(snap, shown, c, _cntry_name[1:], _cntry_name[0]), None, new_key), new_key
+        if new_key == key:
+            raise PreventUpdate
+        fig = chart_figure(snap, shown, c, _cntry_name, points, window)
+        return panel_update(fig, key, new_key, keep_view=zoomed), new_key
+
+
+for panel, chart, c in chart_panels:
+    register_chart_panel(panel, chart, c, rate_modes if chart is confirm_rate else None)
 
 
 ##########################
@@ -396,14 +702,47 @@ summary = dbc.Row(dbc.Col(dbc.Card(dbc.CardBody([
                                     html.Div(text_3, className='ans')
                                     ]), className='figure_summary'), className='figure_rows'))
 
-last_time = np.random.randint(6, 24)
-last_update = f'The data was last updated {last_time} hours ago.'
-data_update = dbc.Row(dbc.Col(html.H6(last_update), className='last_update_1'),
+data_update = dbc.Row(dbc.Col(html.H6(id='data_age'), className='last_update_1'),
                       className='last_update')
+# how often open pages ask for the cards and the data age
+summary_interval = dcc.Interval(id='summary_interval', interval=5*60*1000)
+
+
+def data_age(summary, now=None):
+    hours = int(((now or time.time()) - summary.updated) // 3600)
+    if hours < 1:
+        age = 'less than an hour'
+    elif hours < 48:
+        age = f'{hours} hour{"s" if hours > 1 else ""}'
+    else:
+        age = f'{hours // 24} days'
+    return (f'The data was last updated {age} ago, with figures up to {summary.as_of} '
+            f'({summary.cases_per_million} confirmed cases per million people).')
+
+
+# the cards and the banner on page load and every summary_interval: a few strings
+# from the snapshot's summary, never the rest of the page. The table follows only
+# when the page shows another version of the data (table_version).
+@app.callback([Output('card_confirmed_change', 'children'), Output('card_confirmed', 'children'),
+               Output('card_vaccinated_change', 'children'), Output('card_vaccinated', 'children'),
+               Output('card_deaths_change', 'children'), Output('card_deaths', 'children'),
+               Output('data_age', 'children'), Output('table_card', 'children'), Output('table_version', 'data')],
+              [Input('summary_interval', 'n_intervals')], [State('table_version', 'data')])
+def update_summary(n_intervals, version):
+    snap = snapshot
+    summary = snap.summary
+    table = dash.no_update if version == summary.version else snap.table
+    return [summary.change_confirmed, summary.confirmed, summary.change_vaccinated, summary.vaccinated,
+            summary.change_deaths, summary.deaths, data_age(summary), table, summary.version]
 
 footer = html.Div(dbc.Row([dbc.Col([profile_links])], className='header_container'))
 
 app.layout = html.Div(children=[
+    dcc.Location(id='url'),
+    viewport,
+    summary_interval,
+    table_version,
+    *panel_keys,
     heading,
     fig_map,
     html.Div(dbc.Row([
@@ -418,6 +757,7 @@ app.layout = html.Div(children=[
                     fig_confirmed_daily,
                     fig_recovered_daily,
                     fig_deceased_daily,
+                    rate_mode,
                     fig_confirmed_rate,
                     fig_recovered_rate,
                     fig_deceased_rate,
@@ -430,7 +770,19 @@ app.layout = html.Div(children=[
         footer
         ])
 
-executor = ThreadPoolExecutor(max_workers=1)
+def warm_up():
+    # build the heavy figures of the current snapshot before anyone asks for them
+    try:
+        store = snapshot.store
+        map_figure(store)
+        sunburst_figures(store)
+        figures()
+    except Exception as e:
+        print(f'warming up figures failed: {e}')
+
+
+executor = ThreadPoolExecutor(max_workers=2)
+executor.submit(warm_up)
 executor.submit(update_data)
 
 if __name__ == '__main__':
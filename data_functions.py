@@ -1,7 +1,12 @@
 import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
 import numpy as np
+import base64
+import csv
+import hashlib
+import re
+from functools import lru_cache
+from data_store import metrics, norms
 
 color_dict = {0:'rgba(156, 58, 255, 1)', 1:'rgba(80, 247, 138, 1)',
               2:'rgba(247, 80, 80, 1)', 3:'rgba(253, 241, 73, 1)'}
@@ -14,44 +19,90 @@ def hue(c, h=0.2):
     return c[:-2]+h
 
 
-def clean(country, grp):
-  cnt = grp.get_group(country)
-  cnt_ = cnt.sum(axis=0)
-  cnt_['Country'] = country
-  return pd.DataFrame([cnt_.values], columns=cnt_.keys())
+id_columns = {'Country/Region': 'Country', 'Country_Region': 'Country'}
+
+
+def merge_countries(chunks):
+  # one row per country with its provinces/states summed, sorted by country, from a
+  # frame or from the chunks of a chunked read_csv (partial sums are added up as they
+  # come). Works on the JHU (Country/Region) and govex (Country_Region) layouts;
+  # every non-date column apart from the country is dropped.
+  if isinstance(chunks, pd.DataFrame):
+    chunks = [chunks]
+  total = size = None
+  for df in chunks:
+    df = df.rename(columns=id_columns)
+    dates = [col for col in df.columns if col[:1].isdigit()]
+    grp = df.groupby('Country', sort=False)[dates]
+    # NaN + NaN stays NaN, NaN + x is x
+    part = grp.sum(min_count=1)
+    total = part if total is None else total.add(part, fill_value=0)[dates]
+    size = grp.size() if size is None else size.add(grp.size(), fill_value=0)
+  total = total.sort_index()
+  # provinces are summed skipping gaps, a lone country row keeps its gaps
+  multi = (size.reindex(total.index) > 1).values
+  total.loc[multi] = total.loc[multi].fillna(0)
+  total.index.name = 'Country'
+  return total.reset_index()
+
+
+def read_header(path):
+  # column names of a CSV; pandas builds an empty column for each of the hundreds of
+  # dates just to return them
+  with open(path, newline='') as f:
+    return next(csv.reader(f))
+
+
+def read_merged(path, columns=None, chunksize=20000):
+  # merge_countries of a CSV streamed chunksize rows at a time, parsing only the
+  # country column and the date columns (all of them, or the given header names)
+  # as float64, so memory depends on the chunk size and not on the file. Date
+  # columns come back as ISO days.
+  header = read_header(path)
+  country = [x for x in header if id_columns.get(x, x) == 'Country']
+  if columns is None:
+    columns = [x for x in header if x[:1].isdigit()]
+  dtype = dict.fromkeys(columns, np.float64)
+  dtype[country[0]] = str
+  df = merge_countries(pd.read_csv(path, usecols=country + list(columns), dtype=dtype, chunksize=chunksize))
+  df.columns = ['Country'] + [iso_date(x) for x in df.columns[1:]]
+  return df
 
 
-def merge_countries(df, flag=0):
-  grp = df.groupby('Country')
-  vc = df['Country'].value_counts()
-  prov = list(vc[:list(vc>1).index(False)].keys())
-  for country in prov:
-    cnt = clean(country, grp)
-    df = df[df['Country'] != country]
-    df = pd.concat([df, cnt], ignore_index=True)
-  return df
+iso_file = './country_to_iso.csv'
+
+# upstream country names country_to_iso.csv has no row for
+iso_aliases = {'US': 'USA', 'IRAN': 'IRN', 'Congo (Brazzaville)': 'COG', 'Congo (Kinshasa)': 'COD', "Cote d'Ivoire": 'CIV',
+               'Czechia': 'CZE',
+               'Holy See': 'VAT', 'Iran': 'IRN', 'Korea, South': 'KOR', 'Moldova': 'MDA', 'North Macedonia': 'MKD',
+               'Taiwan*': 'TWN',
+               'Tanzania': 'TZA', 'Syria': 'SYR', 'Laos': 'LAO',
+               'Cabo Verde': 'CPV', 'Eswatini': 'SWZ', 'Kosovo': 'XKX', 'Micronesia': 'FSM', 'West Bank and Gaza': 'PSE'}
 
+# rows upstream reports that are not countries and are never on the map
+not_countries = ['Diamond Princess', 'MS Zaandam', 'Summer Olympics 2020']
 
-def get_alpha_iso(df):
-    x = pd.read_csv('./country_to_iso.csv')[['Country', 'Alpha-3 code']]
-    x['Alpha-3 code'] = x['Alpha-3 code'].apply(lambda x: x[2:-1])
-    dic = {'US': 'USA', 'IRAN': 'IRN', 'Congo (Brazzaville)': 'COG', 'Congo (Kinshasa)': 'COD', "Cote d'Ivoire": 'CIV',
-           'Czechia': 'CZE',
-           'Holy See': 'VAT', 'Iran': 'IRN', 'Korea, South': 'KOR', 'Moldova': 'MDA', 'North Macedonia': 'MKD',
-           'Taiwan*': 'TWN',
-           'Tanzania': 'TZA', 'Syria': 'SYR', 'Laos': 'LAO'}
 
-    for i, j in x.values:
-        dic[i] = j
+def normalize_names(names):
+  # casefolded, without the '*' of 'Taiwan*' and with runs of spaces collapsed
+  return pd.Series(names, dtype=object).str.casefold().str.replace('*', '', regex=False).str.split().str.join(' ')
 
-    alpha = []
-    for i in df['Country'].values:
-        try:
-            alpha.append(dic[i])
-        except:
-            alpha.append('NaN')
 
-    return alpha
+@lru_cache(maxsize=None)
+def iso_table():
+  # normalized name -> ISO alpha-3, read from disk once per process; aliases win
+  df = pd.read_csv(iso_file, skipinitialspace=True, usecols=['Country', 'Alpha-3 code'])
+  table = pd.concat([pd.Series(df['Alpha-3 code'].values, index=normalize_names(df['Country']).values),
+                     pd.Series(list(iso_aliases.values()), index=normalize_names(list(iso_aliases)).values)])
+  return table[~table.index.duplicated(keep='last')]
+
+
+def resolve_iso(countries):
+  # ISO alpha-3 code of every name (NaN when unknown) and the unknown names that are
+  # actual countries, so they can be reported instead of silently left off the map
+  codes = normalize_names(countries).map(iso_table()).values
+  unresolved = pd.isna(codes) & ~np.isin(countries, not_countries)
+  return codes, list(np.asarray(countries)[unresolved])
 
 
 def fix_date(x):
@@ -59,62 +110,186 @@ def fix_date(x):
   return f'20{y}-{"{0:0=2d}".format(int(m))}-{"{0:0=2d}".format(int(d))}'
 
 
-def date_wise(df, flag=0):
-  df = pd.DataFrame(df.reset_index()).iloc[1:].rename(columns={'index':'Date', 0:'Value'})
-  df['Date'] = [x for x in df.Date]
-  # else:
-  #   df['Date'] = [fix_date(x) for x in df.Date]
+def iso_date(x):
+  # JHU headers are m/d/yy, govex headers are already yyyy-mm-dd
+  return fix_date(x) if '/' in x else x
+
+
+def read_history(path, until):
+  # sha1 of the file as it was up to day `until` (ISO), and the header names of the
+  # date columns after it. Those are the last columns of every line and hold plain
+  # numbers, so they are cut off with a byte split from the right: every row and
+  # every loaded day is covered without parsing a single value. The digest is None
+  # when later days are not at the end of the header.
+  header = read_header(path)
+  new = [x for x in header if x[:1].isdigit() and iso_date(x) > until]
+  if header[len(header) - len(new):] != new:
+    return None, new
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for line in f:
+      line = line.rstrip(b'\r\n')
+      h.update((line.rsplit(b',', len(new))[0] if new else line) + b'\n')
+  return h.hexdigest(), new
+
+
+def for_map(store):
+  # latest counts of the countries reported by every source, as a table
+  df = store.latest()
+  df['Confirmed'] = df['Confirmed'].astype(np.int64)
+  df['Deaths'] = df['Deaths'].astype(np.int64)
   return df
 
 
-def for_map(a,b,c, flag='none'):
-  last = a.columns[-1]
-  a = a[['Country', last]].rename(columns={last:'Confirmed'})
-  b = b[['Country', last]].rename(columns={last:'vaccinated'})
-  c = c[['Country', last]].rename(columns={last:'Deaths'})
-  df = pd.merge(a, b, how='inner', on='Country')
-  df = pd.merge(df, c, how='inner', on='Country')
+def map_data(store, i=None, norm='total'):
+  # the same countries as aligned arrays for create_map: ISO codes, confirmed
+  # counts and (vaccinated, deaths) rows for the hover template, on date column i
+  # (the last one with confirmed counts by default) and in `norm` units
+  if i is None:
+    i = store.last['Confirmed']
+  countries = store.countries[store.complete]
+  iso, unresolved = resolve_iso(countries)
+  if unresolved:
+    print(f'no ISO code for {", ".join(unresolved)}; add them to iso_aliases to show them on the map')
+  frame = store.frame(i, norm)
+  # one color scale for every date, so moving the time slider is comparable
+  confirmed = store.by_date[norm]['Confirmed']
+  return {'countries': countries, 'iso': iso, 'confirmed': frame['Confirmed'],
+          'custom': np.column_stack([frame['vaccinated'], frame['Deaths']]), 'day': store.dates[i],
+          'zmin': np.nanmin(confirmed), 'zmax': np.nanmax(confirmed), 'norm': norm}
+
+
+# how each normalization is labeled and its numbers formatted (d3-format)
+norm_labels = {'total': '', 'per100k': ' per 100k people', 'capita': ' per person'}
+norm_formats = {'total': ',', 'per100k': ',.1f', 'capita': '.4f'}
+
+
+def norm_column(metric, norm):
+  # column of a metric in `norm` units in ranking_frame
+  return metric if norm == 'total' else f'{metric} {norm}'
+
+
+def ranking_frame(store):
+  # for_map with every metric also in the other units of norms, for Ranking
+  missing = store.complete & np.isnan(store.population) & ~np.isin(store.countries, not_countries)
+  if missing.any():
+    print(f'no population for {", ".join(store.countries[missing])}; add them to population_overrides '
+          f'(data_store.py) to show them per 100k people')
+  df = for_map(store)
+  for norm, scale in norms.items():
+    if scale is not None:
+      scaled = store.latest(norm)
+      for m in metrics:
+        df[norm_column(m, norm)] = scaled[m].values
+  return df
 
-  if flag=='top':
-    return df
 
-  # idx = df[df['Country'] == 'US'].index[0]
-  # temp = df.loc[idx].values
-  # temp[2], temp[4] = 'data not available', 'data not available'
-  # df.loc[idx] = temp
+def map_title(day, norm='total'):
+  return f'Confirmed cases{norm_labels[norm]} on {day}'
 
-  for col in df.columns:
-    df[col] = df[col].astype(str)
 
-  df['text'] = 'Confirmed cases in ' + df['Country'] + '<br>' + 'vaccinated: ' + \
-                  df['vaccinated'] + '<br>' + 'Deaths: ' + df['Deaths'] + '<br>'
+def map_frame(store, i, norm='total'):
+  # what changes on the map between dates, packed like encode_figure, for
+  # figures.mapDay in assets/figure_patch.js
+  frame = store.frame(i, norm)
+  return {'title': map_title(store.dates[i], norm), 'z': encode_array(frame['Confirmed']),
+          'vaccinated': encode_array(frame['vaccinated']), 'deaths': encode_array(frame['Deaths'])}
 
-  df.drop(columns=['vaccinated','Deaths'], inplace=True)
 
-  df['iso_code'] = get_alpha_iso(df)
+def read_population(path):
+  # population by country from the country-level rows (no province) of the govex
+  # vaccine table, the only shipped source that has it
+  df = pd.read_csv(path, usecols=['Province_State', 'Country_Region', 'Population'],
+                   dtype={'Province_State': str, 'Country_Region': str, 'Population': np.float64})
+  df = df[df['Province_State'].isna()].rename(columns=id_columns)
+  return df.groupby('Country')['Population'].sum(min_count=1)
 
-  return df
+
+def placeholder(height=450):
+    # empty figure shown until the real one has been built
+    return {'data': [], 'layout': {'height': height, 'template': {},
+                                   'paper_bgcolor': 'rgba(0,0,0,0)', 'plot_bgcolor': 'rgba(0,0,0,0)',
+                                   'xaxis': {'visible': False}, 'yaxis': {'visible': False}}}
 
 
-def create_map(df_map):
+def create_map(data):
+    label, fmt = norm_labels[data['norm']], norm_formats[data['norm']]
     fig_map = go.Figure(data=go.Choropleth(
-        locations=df_map['iso_code'],
-        z=df_map['Confirmed'].astype(float),
+        locations=data['iso'],
+        z=data['confirmed'],
         colorscale='teal',
-        text=df_map['text'],  # hover text
+        text=data['countries'],
+        customdata=data['custom'],
+        hovertemplate=f'Confirmed cases{label} in %{{text}}: %{{z:{fmt}}}<br>vaccinated: %{{customdata[0]:{fmt}}}<br>'
+                      f'Deaths: %{{customdata[1]:{fmt}}}<extra>%{{location}}</extra>',
+        zmin=data['zmin'],
+        zmax=data['zmax'],
         marker_line_color='gray',  # line markers between states
-        colorbar_title='number of confirmed cases',
+        colorbar_title=f'number of confirmed cases{label}',
     ), layout=go.Layout(template='plotly_dark'))
 
     fig_map.update_geos(projection_type="orthographic")
     # fig_map.update_geos(projection_type="natural earth")
 
-    fig_map.update_layout(autosize=True, height=600)
+    # uirevision keeps the globe where the user turned it while the slider changes the day
+    fig_map.update_layout(autosize=True, height=600, title_text=map_title(data['day'], data['norm']),
+                          uirevision='map')
 
     return fig_map
 
 
-def create_sunburst(df, feature):
+continent_file = './country_to_continent.csv'
+
+
+@lru_cache(maxsize=None)
+def continents():
+  # country -> continent, upstream (JHU) spelling, read from disk once per process
+  df = pd.read_csv(continent_file)
+  return pd.Series(df['Continent'].values, index=df['Country'].values)
+
+
+def hierarchy(df):
+  # continent -> country tree of every metric column of df (one row per country)
+  # in one pass. Countries without a value for a metric are left out of that
+  # metric's tree; a continent's color is its countries' colors weighted by value,
+  # as px.sunburst does it.
+  parent = df['Country'].map(continents())
+  known = parent.notna().values
+  unresolved = df['Country'].values[~known & ~np.isin(df['Country'].values, not_countries)]
+  if len(unresolved):
+    print(f'no continent for {", ".join(unresolved)}; add them to {continent_file}')
+  countries = df['Country'].values[known].astype(str)
+  parent = parent.values[known].astype(str)
+  values = df[metrics].to_numpy(dtype=np.float64)[known]
+  values[~(values > 0)] = 0
+  names, idx = np.unique(parent, return_inverse=True)
+  totals = np.zeros((len(names), len(metrics)))
+  weighted = np.zeros((len(names), len(metrics)))
+  np.add.at(totals, idx, values)
+  np.add.at(weighted, idx, values ** 2)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    colors = weighted / totals
+  return {'continents': names, 'countries': countries, 'parents': parent,
+          'ids': np.char.add(np.char.add(parent, '/'), countries), 'values': values,
+          'totals': totals, 'colors': colors}
+
+
+def create_sunburst(tree, feature):
+    j = metrics.index(feature)
+    leaf = tree['values'][:, j] > 0
+    top = tree['totals'][:, j] > 0
+    skeleton = sunburst_skeleton(feature)
+    trace = dict(skeleton['data'][0],
+                 ids=np.concatenate([tree['continents'][top], tree['ids'][leaf]]),
+                 labels=np.concatenate([tree['continents'][top], tree['countries'][leaf]]),
+                 parents=np.concatenate([np.full(top.sum(), ''), tree['parents'][leaf]]),
+                 values=np.concatenate([tree['totals'][top, j], tree['values'][leaf, j]]))
+    trace['marker'] = dict(trace['marker'], colors=np.concatenate([tree['colors'][top, j], tree['values'][leaf, j]]))
+    return {'data': [trace], 'layout': skeleton['layout']}
+
+
+@lru_cache(maxsize=None)
+def sunburst_skeleton(feature):
     title = f'Sunburst plot for global {feature.lower()} cases'
     if feature=='Confirmed':
         cc='purple'
@@ -122,37 +297,127 @@ def create_sunburst(df, feature):
         cc='green'
     else:
         cc='red'
-    fig = px.sunburst(df, path=['Continent', 'Country'], values=feature, title=title,
-                      color_continuous_scale=['black', cc], color=feature, template='plotly_dark')
-    return fig
+    fig = go.Figure(go.Sunburst(ids=[], labels=[], parents=[], values=[], branchvalues='total',
+                                marker=dict(colors=[], coloraxis='coloraxis'),
+                                hovertemplate=f'%{{label}}<br>{feature}=%{{value:,}}<extra></extra>'),
+                    layout=go.Layout(template='plotly_dark'))
+    fig.update_layout(title_text=title, coloraxis=dict(colorscale=[[0, 'black'], [1, cc]],
+                                                       colorbar_title_text=feature))
+    return fig.to_dict()
 
 
-def create_global_bar(df_top, top=10, by='Confirmed', order='highest', cnt_name='#'):
-    bool_ = True
-    hovermode = 'x'
-    title = 'the world'
-    barmode = 'stack'
-    title = f'Top {top} countries with {order} {by} cases'
-    if order == 'highest':
-        bool_ = False
+def fill(skeleton, title, *xy):
+    # copy of a cached skeleton with only the trace data and the title replaced;
+    # the skeleton itself is shared and must never be mutated
+    data = [dict(trace, x=x, y=y) for trace, (x, y) in zip(skeleton['data'], xy)]
+    layout = dict(skeleton['layout'], title=dict(skeleton['layout']['title'], text=title))
+    return {'data': data, 'layout': layout}
 
-    if cnt_name != '#':
-        barmode = None
-        hovermode = None
-        df_top = df_top[df_top['Country'] == cnt_name]
-        by = 'Confirmed'
+
+iso_day = re.compile(r'\d{4}-\d\d-\d\d$')
+
+
+def encode_array(a):
+  # numbers as a base64 little-endian typed array: int32 when every value is a whole
+  # number that fits, float64 (NaN for gaps) otherwise
+  a = np.asarray(a, dtype=np.float64)
+  if np.isfinite(a).all() and (a == np.round(a)).all() and (np.abs(a) < 2**31).all():
+    return {'dtype': 'i4', 'bdata': base64.b64encode(a.astype('<i4').tobytes()).decode()}
+  return {'dtype': 'f8', 'bdata': base64.b64encode(a.astype('<f8').tobytes()).decode()}
+
+
+def encode_dates(dates):
+  # ISO days as the first day plus either a count (one value per day) or day offsets
+  days = np.asarray(dates, dtype='datetime64[D]')
+  if len(days) == 0:
+    return []
+  offsets = (days - days[0]).astype(np.int64)
+  if (offsets == np.arange(len(days))).all():
+    return {'start': str(days[0]), 'n': len(days)}
+  return {'start': str(days[0]), 'offsets': encode_array(offsets)}
+
+
+def encode_values(v):
+  if isinstance(v, np.ndarray) and len(v):
+    if v.dtype == object and isinstance(v[0], str):
+      return encode_dates(v) if iso_day.match(v[0]) else v.tolist()
+    return encode_array(v)
+  return v
+
+
+def encode_figure(fig):
+  # fig with its trace x/y packed for assets/figure_patch.js to unpack
+  data = [dict(trace, x=encode_values(trace['x']), y=encode_values(trace['y'])) for trace in fig['data']]
+  return {'data': data, 'layout': fig['layout']}
+
+
+def figure_delta(fig):
+    # the parts of a fill()ed figure that differ between figures of the same skeleton
+    return {'data': [{'x': trace['x'], 'y': trace['y']} for trace in fig['data']],
+            'title': fig['layout']['title']['text']}
+
+
+class Ranking:
+    # rows of a frame ordered by each metric, highest and lowest first, sorted once
+    # per snapshot so a top-N query is a slice; countries are looked up in a dict.
+    # Ties keep the frame's order and NaN ranks last either way.
+
+    def __init__(self, df, columns=metrics):
+        self.values = {col: df[col].to_numpy() for col in df.columns}
+        self.rows = {c: i for i, c in enumerate(self.values['Country'])}
+        self.order = {}
+        for col in columns:
+            v = df[col].to_numpy(dtype=np.float64)
+            self.order[col, 'lowest'] = np.argsort(v, kind='stable')
+            self.order[col, 'highest'] = np.argsort(-v, kind='stable')
+
+    def top(self, n, by='Confirmed', order='highest'):
+        return self.order[by, order][:n]
+
+    def country(self, name):
+        i = self.rows.get(name)
+        return np.arange(0) if i is None else np.array([i])
+
+    def countries(self, names):
+        return np.array([self.rows[c] for c in names if c in self.rows], dtype=np.int64)
+
+
+def create_global_bar(ranking, top=10, by='Confirmed', order='highest', cnt_name='#', norm='total'):
+    title = f'Top {top} countries with {order} {by} cases{norm_labels[norm]}'
+
+    if isinstance(cnt_name, (list, tuple)):
+        # countries picked for comparison, in the order they were picked
+        rows = ranking.countries(cnt_name)
+        title = f'Cases{norm_labels[norm]} in the compared countries'
+    elif cnt_name != '#':
+        rows = ranking.country(cnt_name)[:top]
         title = cnt_name
         if cnt_name == 'US':
             title = 'the United States'
+    else:
+        rows = ranking.top(top, norm_column(by, norm), order)
+
+    x = ranking.values['Country'][rows]
+    return fill(bar_skeleton(isinstance(cnt_name, str) and cnt_name != '#'), title,
+                *[(x, ranking.values[norm_column(m, norm)][rows]) for m in metrics])
+
 
-    df_top = df_top.sort_values(by=by, ascending=bool_).iloc[:top]
+# Skeletons: each chart's traces and layout built and validated by plotly once, then
+# kept as plain dicts that fill() copies the data into.
+@lru_cache(maxsize=None)
+def bar_skeleton(single=False):
+    hovermode = 'x'
+    barmode = 'stack'
+    if single:
+        barmode = None
+        hovermode = None
 
-    fig_global_bar = go.Figure(data=[go.Bar(x=df_top['Country'], y=df_top['Confirmed'], name='confirmed cases', marker_color=color_dict[0]),
-                      go.Bar(x=df_top['Country'], y=df_top['vaccinated'], name='vaccinated cases', marker_color=color_dict[1]),
-                      go.Bar(x=df_top['Country'], y=df_top['Deaths'], name='deaths', marker_color=color_dict[2])
+    fig_global_bar = go.Figure(data=[go.Bar(x=[], y=[], name='confirmed cases', marker_color=color_dict[0]),
+                      go.Bar(x=[], y=[], name='vaccinated cases', marker_color=color_dict[1]),
+                      go.Bar(x=[], y=[], name='deaths', marker_color=color_dict[2])
                       ], layout=go.Layout(template='plotly_dark'))
 
-    fig_global_bar.update_layout(title_text=f"{title}", barmode=barmode, hovermode=hovermode,
+    fig_global_bar.update_layout(title_text='', barmode=barmode, hovermode=hovermode,
                       updatemenus=[dict(buttons=list([dict(label="Linear",
                                                        method="relayout",
                                                        args=[{"yaxis.type": "linear"}]),
@@ -171,22 +436,25 @@ def create_global_bar(df_top, top=10, by='Confirmed', order='highest', cnt_name=
                                     font=dict(color='#777', size=12)
                                               )], font=dict(color='white', size=12),
                   plot_bgcolor='rgba(100,100,100,0)')
-    return fig_global_bar
+    return fig_global_bar.to_dict()
 
 
 
-def confirm_cdf(confirmed, c=0, cntry_name='#'):
+def confirm_cdf(store, c=0, cntry_name='#', points=None, window=None):
     # CDF
     case_type = case_dict[c]
     if cntry_name == '#':
         title = f'Cumulative {case_type} cases in the world'
-        confirmed = date_wise(confirmed.sum(axis=0))
     else:
         title = f'Cumulative {case_type} cases in {cntry_name}'
-        confirmed = date_wise(confirmed[confirmed['Country'] == cntry_name].sum(axis=0))
+    dates, values = store.chart('cdf', metrics[c], cntry_name, points, window)
+    return fill(cdf_skeleton(c), title, (dates, values))
+
 
+@lru_cache(maxsize=None)
+def cdf_skeleton(c=0):
     color = color_dict[c]
-    fig = go.Figure(go.Scatter(x=confirmed['Date'], y=confirmed['Value'], mode='lines+markers'),
+    fig = go.Figure(go.Scatter(x=[], y=[], mode='lines+markers'),
                     layout=go.Layout(template='plotly_dark'))
 
     fig.update_xaxes(
@@ -202,7 +470,7 @@ def confirm_cdf(confirmed, c=0, cntry_name='#'):
     fig.update_traces(marker_color=color, marker_line_color=hue(color),
                       line_width=4)
 
-    fig.update_layout(title_text=title, hovermode='y',
+    fig.update_layout(title_text='', hovermode='y',
                       updatemenus=[dict(buttons=list([dict(label="Linear",
                                                            method="relayout",
                                                            args=[{"yaxis.type": "linear"}]),
@@ -222,25 +490,27 @@ def confirm_cdf(confirmed, c=0, cntry_name='#'):
                                         )], font=dict(color='white', size=12),
                   plot_bgcolor='rgba(100,100,100,0)')
 
-    return fig
+    return fig.to_dict()
 
 
-def confirm_daily(confirmed, c=0, cntry_name='#'):
+def confirm_daily(store, c=0, cntry_name='#', points=None, window=None):
     # Daily
     case_type = case_dict[c]
     if cntry_name == '#':
         title = f'Daily {case_type} cases in the world'
-        confirmed = date_wise(confirmed.sum(axis=0))
     else:
         title = f'Daily {case_type} cases in {cntry_name}'
-        confirmed = date_wise(confirmed[confirmed['Country'] == cntry_name].sum(axis=0))
+    bars = store.chart('daily', metrics[c], cntry_name, points, window)
+    avg = store.chart('avg', metrics[c], cntry_name, points, window)
+    return fill(daily_skeleton(c), title, bars, avg)
 
-    color = color_dict[c]
-    daily_confirmed = confirmed.iloc[:-1].copy()
-    daily_confirmed['Value'] = confirmed.iloc[1:].Value.values - confirmed.iloc[:-1].Value.values
-    daily_confirmed = daily_confirmed[daily_confirmed['Value']>=0]
 
-    fig = go.Figure(go.Bar(x=daily_confirmed['Date'], y=daily_confirmed['Value']),
+@lru_cache(maxsize=None)
+def daily_skeleton(c=0):
+    color = color_dict[c]
+    # bars with their 7-day average drawn over them
+    fig = go.Figure([go.Bar(x=[], y=[], name='daily'),
+                     go.Scatter(x=[], y=[], name='7-day average', mode='lines', line_color='white', line_width=2)],
                     layout=go.Layout(template='plotly_dark'))
 
     fig.update_xaxes(
@@ -256,9 +526,9 @@ def confirm_daily(confirmed, c=0, cntry_name='#'):
     )
 
     fig.update_traces(marker_color=color, marker_line_color=hue(color),
-                      marker_line_width=1.5)
+                      marker_line_width=1.5, selector=dict(type='bar'))
 
-    fig.update_layout(title_text=title,
+    fig.update_layout(title_text='', showlegend=False,
                       updatemenus=[dict(buttons=list([dict(label="Linear",
                                                            method="relayout",
                                                            args=[{"yaxis.type": "linear"}]),
@@ -278,28 +548,45 @@ def confirm_daily(confirmed, c=0, cntry_name='#'):
                                         )], font=dict(color='white', size=12),
                   plot_bgcolor='rgba(100,100,100,0)')
 
-    return fig
+    return fig.to_dict()
 
-def confirm_rate(confirmed, c=0, cntry_name='#'):
+def confirm_rate(store, c=0, cntry_name='#', points=None, window=None):
     # CDF
     case_type = case_dict[c]
     if cntry_name == '#':
         title = f'Rate of {case_type} cases in the world'
-        confirmed = date_wise(confirmed.sum(axis=0)).iloc[132:]
     else:
         title = f'Rate of {case_type} cases in {cntry_name}'
-        confirmed = date_wise(confirmed[confirmed['Country'] == cntry_name].sum(axis=0)).iloc[132:]
+    dates, rate = store.chart('rate', metrics[c], cntry_name, points, window)
+    return fill(rate_skeleton(c), title, (dates, rate))
 
-    color = color_dict[c]
-    daily_confirmed = confirmed.iloc[:-1].copy()
 
-    den = confirmed.iloc[:-1].Value.values
-    den = np.where(den == 0, 1, den)
-    daily_confirmed['Value'] = 100 * (
-                confirmed.iloc[1:].Value.values - confirmed.iloc[:-1].Value.values) / den
+# other modes of the rate panels, see rate_modes in covid_plotly.py
+def confirm_doubling(store, c=0, cntry_name='#', points=None, window=None):
+    case_type = case_dict[c]
+    if cntry_name == '#':
+        title = f'Days for {case_type} cases in the world to double'
+    else:
+        title = f'Days for {case_type} cases in {cntry_name} to double'
+    dates, days = store.chart('doubling', metrics[c], cntry_name, points, window)
+    return fill(rate_skeleton(c), title, (dates, days))
+
 
+def confirm_growth(store, c=0, cntry_name='#', points=None, window=None):
+    case_type = case_dict[c]
+    if cntry_name == '#':
+        title = f'Weekly growth of new {case_type} cases in the world'
+    else:
+        title = f'Weekly growth of new {case_type} cases in {cntry_name}'
+    dates, ratio = store.chart('growth', metrics[c], cntry_name, points, window)
+    return fill(rate_skeleton(c), title, (dates, ratio))
+
+
+@lru_cache(maxsize=None)
+def rate_skeleton(c=0):
+    color = color_dict[c]
     fig = go.Figure(
-        go.Scatter(x=daily_confirmed['Date'], y=daily_confirmed['Value'], line_color=color, mode='lines+markers'),
+        go.Scatter(x=[], y=[], line_color=color, mode='lines+markers'),
         layout=go.Layout(template='plotly_dark'))
 
     fig.update_xaxes(
@@ -317,7 +604,66 @@ def confirm_rate(confirmed, c=0, cntry_name='#'):
     fig.update_traces(marker_color=color, marker_line_color=hue(color),
                       marker_line_width=1.5)
 
-    fig.update_layout(title_text=title,
+    fig.update_layout(title_text='',
+                      updatemenus=[dict(buttons=list([dict(label="Linear",
+                                                           method="relayout",
+                                                           args=[{"yaxis.type": "linear"}]),
+                                                      dict(label="Log",
+                                                           method="relayout",
+                                                           args=[{"yaxis.type": "log"}]),
+                                                      ]),
+                                        direction="right",
+                                        pad={"r": 10, "t": 10},
+                                        showactive=True,
+                                        x=0,
+                                        xanchor="left",
+                                        y=-0.6,
+                                        yanchor="top",
+                                        bgcolor='rgba(100,100,100,0.2)',
+                                        font=dict(color='#777', size=12)
+                                        )], font=dict(color='white', size=12),
+                  plot_bgcolor='rgba(100,100,100,0)')
+
+    return fig.to_dict()
+
+
+# compare mode: one line per country. Daily counts are drawn as their 7-day average,
+# overlaid bars would hide each other.
+compare_titles = {'cdf': 'Cumulative {} cases', 'avg': 'Daily {} cases (7-day average)', 'rate': 'Rate of {} cases',
+                  'doubling': 'Days for {} cases to double', 'growth': 'Weekly growth of new {} cases'}
+
+
+def compare_chart(store, c=0, kind='cdf', countries=(), align=None):
+    # every country's series comes from one gather over the precomputed matrices. With
+    # align, day 0 of each is the day its cumulative count reached align.
+    x, y = store.gather(kind, metrics[c], countries)
+    title = compare_titles[kind].format(case_dict[c])
+    if align:
+        # every kind's columns line up with the cdf's
+        _, cum = store.gather('cdf', metrics[c], countries)
+        reached = cum >= align
+        start = np.where(reached.any(axis=1), reached.argmax(axis=1), cum.shape[1])
+        days = np.arange(y.shape[1])
+        series = [(days[s:] - s, row[s:]) for s, row in zip(start, y)]
+        xaxis = f'days since {case_dict[c]} cases reached {align:,}'
+    else:
+        series = [(x, row) for row in y]
+        xaxis = ''
+    skeleton = compare_skeleton()
+    data = [dict(skeleton['data'][0], x=sx, y=sy, name=name) for name, (sx, sy) in zip(countries, series)]
+    layout = dict(skeleton['layout'], title=dict(skeleton['layout']['title'], text=title),
+                  xaxis=dict(skeleton['layout']['xaxis'], title={'text': xaxis}))
+    return {'data': data, 'layout': layout}
+
+
+@lru_cache(maxsize=None)
+def compare_skeleton():
+    fig = go.Figure(go.Scatter(x=[], y=[], mode='lines', line_width=2),
+                    layout=go.Layout(template='plotly_dark'))
+
+    fig.update_xaxes(rangeslider_visible=True)
+
+    fig.update_layout(title_text='', hovermode='x',
                       updatemenus=[dict(buttons=list([dict(label="Linear",
                                                            method="relayout",
                                                            args=[{"yaxis.type": "linear"}]),
@@ -337,4 +683,4 @@ def confirm_rate(confirmed, c=0, cntry_name='#'):
                                         )], font=dict(color='white', size=12),
                   plot_bgcolor='rgba(100,100,100,0)')
 
-    return fig
\ No newline at end of file
+    return fig.to_dict()
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from analytics import doubling_time, growth_ratio, percent_growth, rolling_mean
+from downsample import detail, lttb, minmax
+
+metrics = ['Confirmed', 'vaccinated', 'Deaths']
+
+# units counts can be shown in: the multiplier applied to counts per person
+norms = {'total': None, 'per100k': 1e5, 'capita': 1}
+
+# people living in countries the vaccine table has no population for (ranking_frame
+# lists them), e.g. {'Korea, South': 51269183}. Applied whenever a store is built or
+# loaded, so saved snapshots pick up edits here.
+population_overrides = {}
+
+# bumped when save() starts writing something load() needs, so older snapshots are
+# rebuilt instead of loaded
+store_format = 5
+
+# how each chart kind is thinned out: bars keep every bucket's extremes, lines the
+# points that shape them
+reducers = {'cdf': lttb, 'daily': minmax, 'avg': lttb, 'rate': lttb, 'doubling': lttb, 'growth': lttb}
+
+# chart kinds whose matrices are saved with the values (see derive)
+kinds = list(reducers)
+# kinds whose first day with a value differs per country, see precompute
+trends = ['rate', 'doubling', 'growth']
+
+
+class TimeSeriesStore:
+    # one (countries x days) float matrix per metric, all sharing the same
+    # country rows and date columns. Dates a metric was not reported for are NaN.
+
+    def __init__(self, countries, dates, values, present=None, version=None, totals=None, population=None,
+                 derived=None, digests=None):
+        self.countries = np.asarray(countries, dtype=object)
+        self.dates = np.asarray(dates, dtype=object)
+        self.index = {c: i for i, c in enumerate(self.countries)}
+        self.values = {m: np.ascontiguousarray(v, dtype=np.float64) for m, v in values.items()}
+
+        # first and last date columns holding data for each metric (vaccinations start late)
+        self.first = {}
+        self.last = {}
+        for m, v in self.values.items():
+            has_data = ~np.isnan(v).all(axis=0)
+            self.first[m] = int(has_data.argmax()) if has_data.any() else len(self.dates)
+            self.last[m] = len(self.dates) - 1 - int(has_data[::-1].argmax()) if has_data.any() else -1
+
+        if totals is None:
+            totals = {m: world_totals(v) for m, v in self.values.items()}
+        self.totals = totals
+        # countries reported by each metric's source, and by all of them
+        if present is None:
+            present = {m: np.ones(len(self.countries), dtype=bool) for m in self.values}
+        self.present = present
+        self.complete = np.all(list(present.values()), axis=0)
+        # people living in each country, NaN where unknown
+        if population is None:
+            population = np.full(len(self.countries), np.nan)
+        self.population = np.array(population, dtype=np.float64)
+        for country, people in population_overrides.items():
+            if country in self.index:
+                self.population[self.index[country]] = people
+        # checksum of the source files, part of every cache key derived from this store
+        self.version = version
+        # metric -> digest of the part of its source file loaded here (see read_history),
+        # so a refresh can tell appended days from revised ones
+        self.digests = digests or {}
+        # (dates x countries) copies for the map per normalization, see frame(); built
+        # on first use and private to the process
+        self.by_date = {}
+        self.precompute(derived)
+
+    @classmethod
+    def from_frames(cls, frames, version=None, population=None):
+        # frames: metric -> wide frame with a 'Country' column and ISO date columns,
+        # one row per country (see merge_countries); population: Series by country
+        frames = {m: df.set_index('Country') for m, df in frames.items()}
+        countries = sorted(set().union(*[df.index for df in frames.values()]))
+        dates = sorted(set().union(*[df.columns for df in frames.values()]))
+        # a country missing from one source counts as zero there, like an empty filter did
+        values = {m: df.reindex(index=countries, fill_value=0).reindex(columns=dates).to_numpy(dtype=np.float64)
+                  for m, df in frames.items()}
+        present = {m: np.isin(countries, df.index) for m, df in frames.items()}
+        if population is not None:
+            population = population.reindex(countries).to_numpy(dtype=np.float64)
+        return cls(countries, dates, values, present, version, population=population)
+
+    def save(self, directory):
+        # write the matrices as .npy files plus meta.json to directory/<version>-<format> through a
+        # temp directory renamed into place, then drop the snapshots of older versions
+        os.makedirs(directory, exist_ok=True)
+        current = f'{self.version}-{store_format}'
+        target = os.path.join(directory, current)
+        if os.path.isdir(target):
+            return
+        tmp = tempfile.mkdtemp(dir=directory, prefix='.tmp-')
+        meta = {'version': self.version, 'countries': list(self.countries), 'dates': list(self.dates),
+                'metrics': list(self.values), 'present': {m: p.tolist() for m, p in self.present.items()},
+                'digests': self.digests}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        for i, m in enumerate(self.values):
+            np.save(os.path.join(tmp, f'values_{i}.npy'), self.values[m])
+            np.save(os.path.join(tmp, f'totals_{i}.npy'), self.totals[m])
+            for kind in kinds:
+                np.save(os.path.join(tmp, f'{kind}_{i}.npy'), self.matrices[kind, m][1])
+        np.save(os.path.join(tmp, 'population.npy'), self.population)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # another worker saved the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+        for name in os.listdir(directory):
+            if name != current and not name.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, version):
+        # memory-map the snapshot save() wrote for this version, None when there is none.
+        # Every process mapping the same files shares their pages, the chart matrices
+        # included, so workers do not each hold their own copy of them.
+        target = os.path.join(directory, f'{version}-{store_format}')
+        try:
+            with open(os.path.join(target, 'meta.json')) as f:
+                meta = json.load(f)
+            values = {}
+            totals = {}
+            derived = {}
+            for i, m in enumerate(meta['metrics']):
+                values[m] = np.load(os.path.join(target, f'values_{i}.npy'), mmap_mode='r')
+                totals[m] = np.load(os.path.join(target, f'totals_{i}.npy'), mmap_mode='r')
+                for kind in kinds:
+                    derived[kind, m] = np.load(os.path.join(target, f'{kind}_{i}.npy'), mmap_mode='r')
+            population = np.load(os.path.join(target, 'population.npy'))
+        except (OSError, ValueError, KeyError):
+            return None
+        present = {m: np.asarray(p, dtype=bool) for m, p in meta['present'].items()}
+        return cls(meta['countries'], meta['dates'], values, present, meta['version'], totals, population, derived,
+                   meta['digests'])
+
+    def extend(self, frames, version=None):
+        # store with the days of frames written in. frames map some metrics to merged
+        # frames (see merge_countries) of the days after the last one loaded for them:
+        # days the store already has from other sources (a source catching up) fill
+        # their columns, later ones are appended, NaN for the metrics without them.
+        # The caller checks that the days already loaded are unchanged (read_history).
+        # None when a frame has countries or days that cannot be placed this way.
+        frames = {m: df.set_index('Country') for m, df in frames.items()}
+        new_dates = sorted(set().union(*[df.columns for df in frames.values()]) - set(self.dates))
+        if not frames or (new_dates and new_dates[0] <= self.dates[-1]):
+            return None
+        dates = np.concatenate([self.dates, np.asarray(new_dates, dtype=object)])
+        column = {d: i for i, d in enumerate(dates)}
+        values = {}
+        totals = {}
+        for m, v in self.values.items():
+            v = np.hstack([v, np.full((len(self.countries), len(new_dates)), np.nan)])
+            total = np.concatenate([self.totals[m], np.full(len(new_dates), np.nan)])
+            if m in frames:
+                df = frames[m]
+                cols = [column[d] for d in df.columns]
+                if not df.index.isin(self.countries).all() or min(cols) <= self.last[m]:
+                    return None
+                v[:, cols] = df.reindex(index=self.countries, fill_value=0).to_numpy(dtype=np.float64)
+                total[cols] = world_totals(v[:, cols])
+            values[m] = v
+            totals[m] = total
+        return TimeSeriesStore(self.countries, dates, values, self.present, version, totals, self.population)
+
+    def precompute(self, derived=None):
+        # (x, y) of every chart kind for every country, the world ('#') and unknown
+        # names (None, all zeros), as row views of one matrix per kind and metric.
+        # derived: those matrices as load() mapped them, computed (see derive) when None
+        self.charts = {}
+        # (x, matrix) of every kind, rows as in `names`, for gather()
+        self.matrices = {}
+        # reduced indices of each chart, filled in as charts are asked for at a resolution
+        self.overviews = {}
+        names = list(self.countries) + ['#', None]
+        for m, v in self.values.items():
+            start = self.first[m]
+            dates = self.dates[start:]
+            if derived is None:
+                matrices = derive(v[:, start:], self.totals[m][start:])
+            else:
+                matrices = {kind: derived[kind, m] for kind in kinds}
+            for kind, y in matrices.items():
+                # kinds built from day to day differences are one day shorter
+                x = dates[:y.shape[1]]
+                self.matrices[kind, m] = (x, y)
+                if kind in trends:
+                    # each country's trend starts on its first day with a value
+                    finite = np.isfinite(y)
+                    lead = np.where(finite.any(axis=1), finite.argmax(axis=1), y.shape[1])
+                else:
+                    lead = np.zeros(len(names), dtype=np.int64)
+                for i, name in enumerate(names):
+                    self.charts[kind, m, name] = (x[lead[i]:], y[i, lead[i]:])
+
+    def chart(self, kind, metric, country='#', points=None, window=None):
+        # (x, y) of a chart, thinned to about `points` values when it is longer than
+        # that. window = [first, last] ISO days keeps every point in that range as
+        # well (up to `points` of them), so a zoomed-in chart shows full detail.
+        key = (kind, metric, country)
+        if key not in self.charts:
+            key = (kind, metric, None)
+        x, y = self.charts[key]
+        if points is None or len(y) <= points:
+            return x, y
+        reduce = reducers[kind]
+        overview = self.overviews.get(key + (points,))
+        if overview is None:
+            overview = self.overviews[key + (points,)] = reduce(y, points)
+        if window is None:
+            idx = overview
+        else:
+            lo, hi = np.searchsorted(x, window[0]), np.searchsorted(x, window[1], side='right')
+            # one point past each edge so lines run off the visible range
+            idx = detail(y, points, overview, max(lo - 1, 0), min(hi + 1, len(y)), reduce)
+        return x[idx], y[idx]
+
+    def gather(self, kind, metric, countries):
+        # x and the (len(countries) x days) block of a chart kind for several countries
+        # at once, one fancy-indexing gather. '#' is the world, unknown names all zeros.
+        x, matrix = self.matrices[kind, metric]
+        world = len(self.countries)
+        rows = [world if c == '#' else self.index.get(c, world + 1) for c in countries]
+        return x, matrix[rows]
+
+    def day(self, metric, i=None):
+        # values of every country on a single date column, by default the last one
+        # the metric's source reported (the sources do not all end on the same day)
+        return self.values[metric][:, self.last[metric] if i is None else i]
+
+    def scale(self, norm, rows=slice(None)):
+        # what counts of each country (of rows) are multiplied by to get them in `norm`
+        # units (see norms), NaN where the population is unknown; None for plain counts
+        if norms[norm] is None:
+            return None
+        with np.errstate(divide='ignore'):
+            return norms[norm] / self.population[rows]
+
+    def frame(self, i=-1, norm='total'):
+        # every metric on date column i for the countries in latest(), in `norm` units.
+        # Rows of (dates x countries) matrices built on first use, one broadcast
+        # multiplication per metric, so scrubbing the map through time reads
+        # contiguous memory.
+        if norm not in self.by_date:
+            factor = self.scale(norm, self.complete)
+            self.by_date[norm] = {m: np.ascontiguousarray(v[self.complete].T) if factor is None
+                                  else v[self.complete].T * factor for m, v in self.values.items()}
+        return {m: v[i] for m, v in self.by_date[norm].items()}
+
+    def latest(self, norm='total'):
+        # every metric on its own last reported day for the countries reported in all of them
+        df = pd.DataFrame({'Country': self.countries[self.complete]})
+        factor = self.scale(norm, self.complete)
+        for m in metrics:
+            df[m] = self.day(m)[self.complete] if factor is None else self.day(m)[self.complete] * factor
+        return df
+
+
+def derive(v, totals):
+    # every chart kind's matrix of one metric, computed over whole matrices at once
+    # (see analytics): rows are the countries of v, the world (totals) and all zeros
+    full = np.vstack([v, totals, np.zeros(v.shape[1])])
+    daily = np.diff(full, axis=1)
+    rate = percent_growth(full, daily)
+    # negative corrections are not drawn, but keep their day so every
+    # daily series stays on the shared, evenly spaced date axis
+    with np.errstate(invalid='ignore'):
+        daily = np.where(daily >= 0, daily, np.nan)
+    return {'cdf': full, 'daily': daily, 'avg': rolling_mean(daily), 'rate': rate,
+            'doubling': doubling_time(full), 'growth': growth_ratio(daily)}
+
+
+def world_totals(v):
+    # sum over countries per date column; NaN on days no country was reported for,
+    # e.g. past the end of a source that is a day behind the others
+    totals = np.nansum(v, axis=0)
+    totals[np.isnan(v).all(axis=0)] = np.nan
+    return totals
+
+
+def checksum(paths):
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            # in blocks, so a large file is never held in memory whole
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
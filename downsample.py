@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def lttb(y, n):
+    # indices of n points of y (x = 0, 1, ...) picked by largest-triangle-three-buckets:
+    # first and last point, then per bucket the one spanning the largest triangle with
+    # the point picked before it and the mean of the next bucket. Keeps peaks and turns.
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+    v = np.nan_to_num(np.asarray(y, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    means = np.add.reduceat(v[1:-1], edges[:-1] - 1) / np.diff(edges)
+    centers = (edges[:-1] + edges[1:] - 1) / 2
+    picked = np.empty(n, dtype=np.int64)
+    picked[0], picked[-1] = 0, size - 1
+    a = 0
+    for b in range(n - 2):
+        lo, hi = edges[b], edges[b + 1]
+        if b + 1 < n - 2:
+            cx, cy = centers[b + 1], means[b + 1]
+        else:
+            cx, cy = size - 1, v[-1]
+        xs = np.arange(lo, hi)
+        area = np.abs((a - cx) * (v[lo:hi] - v[a]) - (a - xs) * (cy - v[a]))
+        a = lo + int(area.argmax())
+        picked[b + 1] = a
+    return picked
+
+
+def minmax(y, n):
+    # indices of the lowest and highest value in each of n // 2 equal buckets, plus the
+    # first and last point. All-NaN buckets keep one NaN so gaps stay gaps.
+    size = len(y)
+    if n >= size or n < 4:
+        return np.arange(size)
+    width = -(-size // (n // 2))
+    rows = np.full(width * -(-size // width), np.nan)
+    rows[:size] = y
+    rows = rows.reshape(-1, width)
+    missing = np.isnan(rows)
+    base = np.arange(len(rows)) * width
+    lo = base + np.where(missing, np.inf, rows).argmin(axis=1)
+    hi = base + np.where(missing, -np.inf, rows).argmax(axis=1)
+    picked = np.unique(np.concatenate([lo, hi, [0, size - 1]]))
+    return picked[picked < size]
+
+
+def detail(y, n, overview, lo, hi, reduce):
+    # overview indices with the points in [lo, hi) added, themselves reduced to n
+    # when the window alone holds more than that
+    inside = lo + reduce(y[lo:hi], n)
+    return np.union1d(overview[(overview < lo) | (overview >= hi)], inside)
@@ -0,0 +1,94 @@
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_state(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def temp_file(path, mode):
+    # open file next to path under a name of its own, so workers writing the same
+    # path at once never share (and rename away) each other's partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.part')
+    return os.fdopen(fd, mode), tmp
+
+
+def save_state(state, state_file):
+    f, tmp = temp_file(state_file, 'w')
+    with f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, state_file)
+
+
+def fetch(url, path, validators=None, timeout=30, retries=3):
+    # download url to path through a temporary file and a rename. validators holds the
+    # ETag/Last-Modified of the copy on disk; the server answering 304 leaves it alone.
+    # Returns a result dict with status 'updated', 'unchanged' or 'failed'.
+    start = time.time()
+    headers = {}
+    if validators and os.path.exists(path):
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    result = {'url': url, 'path': path, 'attempts': 0}
+    for attempt in range(retries):
+        result['attempts'] = attempt + 1
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as resp:
+                f, tmp = temp_file(path, 'wb')
+                try:
+                    with f:
+                        shutil.copyfileobj(resp, f)
+                    # a read of a set size just stops when the connection drops early;
+                    # bytes still owed by Content-Length mean the copy is cut short
+                    if getattr(resp, 'length', None):
+                        raise http.client.IncompleteRead(b'', resp.length)
+                    os.replace(tmp, path)
+                finally:
+                    # whatever cut the copy short, the partial file goes
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                result.update(status='updated', validators={'etag': resp.headers.get('ETag'),
+                                                            'last_modified': resp.headers.get('Last-Modified')})
+                break
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                result.update(status='unchanged', validators=validators)
+                break
+            result.update(status='failed', error=f'HTTP {e.code}')
+            if e.code < 500 and e.code != 429:
+                break
+        except (urllib.error.URLError, OSError, http.client.HTTPException) as e:
+            # HTTPException covers a body cut short (IncompleteRead) or a garbled reply
+            result.update(status='failed', error=str(e) or type(e).__name__)
+        if attempt + 1 < retries:
+            time.sleep(0.5 * 2 ** attempt)
+
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+def fetch_all(sources, state_file, timeout=30, retries=3):
+    # fetch every (url, path) pair at once, skipping files the server reports unchanged;
+    # the validators of each source are kept in state_file between runs
+    state = load_state(state_file)
+    with ThreadPoolExecutor(max_workers=max(1, len(sources))) as pool:
+        results = list(pool.map(lambda s: fetch(s[0], s[1], state.get(s[0]), timeout, retries), sources))
+    for r in results:
+        if r['status'] != 'failed':
+            state[r['url']] = r['validators']
+    save_state(state, state_file)
+    return results
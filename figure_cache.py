@@ -0,0 +1,157 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class MemoryBackend:
+    # per-process LRU, entries are (timestamp, value)
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data.move_to_end(key)
+            return item
+
+    def set(self, key, item):
+        with self._lock:
+            self._data[key] = item
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileBackend:
+    # one pickle per key in a directory every worker on the host can see (point it
+    # at /dev/shm to keep it in shared memory). Writes go through a temp file and
+    # os.replace so readers never see a partial entry; mtime tracks recency.
+
+    def __init__(self, directory, maxsize=256):
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                item = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return item
+
+    def set(self, key, item):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except OSError:
+                    pass
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        for _, name in sorted(entries)[:max(0, len(entries) - self.maxsize)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def clear(self):
+        for _, name in self._entries():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+
+def backend_from_env(maxsize=256):
+    # CACHE_DIR set -> shared FileBackend, otherwise an in-process MemoryBackend
+    directory = os.environ.get('CACHE_DIR')
+    if directory:
+        return FileBackend(directory, maxsize)
+    return MemoryBackend(maxsize)
+
+
+class FigureCache:
+    # rendered figures (plain dicts) and parsed datasets keyed by normalized inputs;
+    # entries older than ttl seconds are treated as misses
+
+    def __init__(self, backend=None, ttl=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self.backend.get(key)
+        if item is not None and self.ttl is not None and time.time() - item[0] > self.ttl:
+            self.backend.delete(key)
+            item = None
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        self.backend.set(key, (time.time(), value))
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def get_or_build(self, key, build):
+        return self.get_or_compute(key, lambda: build().to_dict())
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.backend),
+                'maxsize': self.backend.maxsize, 'ttl': self.ttl,
+                'backend': type(self.backend).__name__}
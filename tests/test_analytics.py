@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from analytics import doubling_time, growth_ratio, min_base, percent_growth, rolling_mean, window_sums
+
+
+def random_matrix(seed, rows=5, cols=60, gaps=0.2):
+    # cumulative-looking counts with NaN holes, rows as countries
+    rng = np.random.default_rng(seed)
+    m = rng.integers(0, 500, size=(rows, cols)).cumsum(axis=1).astype(np.float64)
+    m[rng.random(m.shape) < gaps] = np.nan
+    return m
+
+
+def test_window_sums_match_pandas():
+    m = random_matrix(0)
+    sums, counts = window_sums(m, 7)
+    df = pd.DataFrame(m.T)
+    np.testing.assert_allclose(sums, df.fillna(0).rolling(7, min_periods=1).sum().to_numpy().T)
+    np.testing.assert_array_equal(counts, df.notna().rolling(7, min_periods=1).sum().to_numpy().T)
+
+
+def test_rolling_mean_matches_pandas():
+    m = random_matrix(1)
+    expected = pd.DataFrame(m.T).rolling(7, min_periods=1).mean().to_numpy().T
+    expected[:, :6] = np.nan
+    np.testing.assert_allclose(rolling_mean(m), expected)
+
+
+def test_rolling_mean_of_an_empty_window_is_nan():
+    m = np.full((1, 20), np.nan)
+    m[0, :3] = 1
+    mean = rolling_mean(m)
+    assert mean[0, 6] == 1
+    assert np.isnan(mean[0, 10:]).all()
+
+
+def test_percent_growth_starts_at_min_base():
+    cum = np.array([[min_base / 2, min_base, min_base * 1.5, min_base * 3]])
+    daily = np.diff(cum, axis=1)
+    np.testing.assert_allclose(percent_growth(cum, daily), [[np.nan, 50, 100]])
+
+
+def test_doubling_time_of_exponential_growth():
+    # doubling every 5 days, from one case: the time shows once 7 days back reaches min_base
+    days = np.arange(80)
+    cum = 2 ** (days / 5)[None, :]
+    doubling = doubling_time(cum)
+    known = ~np.isnan(doubling[0])
+    np.testing.assert_allclose(doubling[0, known], 5)
+    first = int(np.argmax(cum[0] >= min_base))
+    assert known.argmax() == first + 7
+
+
+def test_doubling_time_is_nan_when_flat():
+    cum = np.full((1, 30), 1000.0)
+    assert np.isnan(doubling_time(cum)).all()
+
+
+def test_growth_ratio_matches_pandas():
+    m = np.diff(random_matrix(2, gaps=0), axis=1)
+    weekly = pd.DataFrame(m.T).rolling(7).sum()
+    expected = (weekly / weekly.shift(7)).to_numpy().T
+    np.testing.assert_allclose(growth_ratio(m), expected)
+
+
+def test_growth_ratio_of_a_quiet_week_is_nan():
+    daily = np.zeros((1, 40))
+    daily[0, 20:] = 5
+    ratio = growth_ratio(daily)
+    # no new cases before day 20: there is nothing to compare a week against until day 27
+    assert np.isnan(ratio[0, :27]).all()
+    assert ratio[0, 27] == 7
+    # two full weeks of 5 a day
+    assert ratio[0, -1] == 1
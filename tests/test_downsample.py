@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from downsample import detail, lttb, minmax
+
+
+def reference_lttb(y, n):
+    # largest-triangle-three-buckets point by point, with the same buckets as lttb
+    size = len(y)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    picked = [0]
+    for b in range(n - 2):
+        lo, hi = edges[b], edges[b + 1]
+        if b + 1 < n - 2:
+            nxt = range(edges[b + 1], edges[b + 2])
+            cx, cy = sum(nxt) / len(nxt), sum(y[i] for i in nxt) / len(nxt)
+        else:
+            cx, cy = size - 1, y[-1]
+        a = picked[-1]
+        areas = [abs((a - cx) * (y[i] - y[a]) - (a - i) * (cy - y[a])) for i in range(lo, hi)]
+        picked.append(lo + int(np.argmax(areas)))
+    return picked + [size - 1]
+
+
+@pytest.mark.parametrize('size, n', [(600, 300), (601, 50), (1000, 3), (10, 9)])
+def test_lttb_matches_reference(size, n):
+    y = np.random.default_rng(size).normal(size=size).cumsum()
+    picked = lttb(y, n)
+    assert len(picked) == n
+    np.testing.assert_array_equal(picked, reference_lttb(list(y), n))
+
+
+def test_lttb_keeps_spikes_and_ends():
+    y = np.zeros(1000)
+    y[437] = 50
+    y[800] = -20
+    picked = lttb(y, 40)
+    assert picked[0] == 0 and picked[-1] == 999
+    assert 437 in picked and 800 in picked
+    assert (np.diff(picked) > 0).all()
+
+
+def test_lttb_short_series_unchanged():
+    np.testing.assert_array_equal(lttb(np.arange(5.0), 10), np.arange(5))
+    np.testing.assert_array_equal(lttb(np.arange(5.0), 2), np.arange(5))
+
+
+def test_lttb_tolerates_gaps():
+    y = np.random.default_rng(1).normal(size=500)
+    y[:100] = np.nan
+    y[250] = np.inf
+    picked = lttb(y, 60)
+    assert len(picked) == 60 and (np.diff(picked) > 0).all()
+
+
+def test_minmax_keeps_bucket_extremes():
+    y = np.random.default_rng(2).normal(size=997)
+    n = 100
+    picked = minmax(y, n)
+    assert picked[0] == 0 and picked[-1] == 996
+    assert len(picked) <= n + 2 and (np.diff(picked) > 0).all()
+    width = -(-len(y) // (n // 2))
+    for start in range(0, len(y), width):
+        bucket = y[start:start + width]
+        assert start + bucket.argmin() in picked
+        assert start + bucket.argmax() in picked
+
+
+def test_minmax_keeps_gaps():
+    y = np.arange(1000.0)
+    y[200:400] = np.nan
+    picked = minmax(y, 20)
+    # buckets of 100 days: each of the two inside the gap keeps one NaN, so the bars show it
+    assert np.isnan(y[picked]).sum() == 2
+    assert np.nanmax(y[picked]) == 999
+
+
+def test_detail_adds_the_window():
+    y = np.random.default_rng(3).normal(size=1000)
+    overview = lttb(y, 100)
+    picked = detail(y, 300, overview, 400, 500, lttb)
+    # the 100 days of the window fit in 300 points: all of them are kept
+    assert set(range(400, 500)) <= set(picked)
+    outside = picked[(picked < 400) | (picked >= 500)]
+    np.testing.assert_array_equal(outside, overview[(overview < 400) | (overview >= 500)])
+
+
+def test_detail_reduces_a_wide_window():
+    y = np.random.default_rng(4).normal(size=1000)
+    overview = minmax(y, 50)
+    picked = detail(y, 100, overview, 100, 900, minmax)
+    inside = picked[(picked >= 100) & (picked < 900)]
+    assert len(inside) <= 102
@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pytest
+from conftest import root
+from data_functions import read_header, read_history, read_merged
+from data_store import TimeSeriesStore, kinds, metrics
+
+data_files = [os.path.join(root, 'data', name) for name in ['time_series_covid19_confirmed_global.csv',
+                                                            'time_series_covid19_vaccine_doses_admin_global.csv',
+                                                            'time_series_covid19_deaths_global.csv']]
+
+
+def cut(path, directory, days):
+    # copy of a CSV without its last `days` date columns, as upstream had it then
+    target = os.path.join(str(directory), os.path.basename(path))
+    with open(path, 'rb') as f, open(target, 'wb') as out:
+        for line in f:
+            out.write(line.rstrip(b'\r\n').rsplit(b',', days)[0] + b'\n')
+    return target
+
+
+def build(paths):
+    return TimeSeriesStore.from_frames({m: read_merged(f) for m, f in zip(metrics, paths)})
+
+
+def days_after(store, paths):
+    # what extend_store passes on: the columns each file has past the store's last day of it
+    frames = {}
+    for m, f in zip(metrics, paths):
+        _, new = read_history(f, store.dates[store.last[m]])
+        if new:
+            frames[m] = read_merged(f, new)
+    return frames
+
+
+def assert_same_store(store, expected):
+    np.testing.assert_array_equal(store.countries, expected.countries)
+    np.testing.assert_array_equal(store.dates, expected.dates)
+    for m in metrics:
+        np.testing.assert_array_equal(store.values[m], expected.values[m])
+        np.testing.assert_array_equal(store.totals[m], expected.totals[m])
+        assert store.last[m] == expected.last[m]
+        for kind in kinds:
+            np.testing.assert_allclose(store.matrices[kind, m][1], expected.matrices[kind, m][1])
+
+
+@pytest.fixture(scope='module')
+def full():
+    return build(data_files)
+
+
+def test_appended_days_extend(full, tmp_path):
+    old = build([cut(f, tmp_path, 5) for f in data_files])
+    new = old.extend(days_after(old, data_files), 'v2')
+    assert new.version == 'v2'
+    assert_same_store(new, full)
+
+
+def test_lagging_source_catches_up(full, tmp_path):
+    # vaccinations and deaths a day behind confirmed cases, then confirmed cases a day
+    # further on with deaths catching up past them: the days the store already has
+    # get filled in, the one after is appended
+    paths = [cut(f, tmp_path, days) for f, days in zip(data_files, [4, 5, 5])]
+    old = build(paths)
+    assert old.last['Deaths'] == old.last['Confirmed'] - 1
+    newer = tmp_path / 'newer'
+    newer.mkdir()
+    paths = [cut(f, newer, days) for f, days in zip(data_files, [3, 4, 3])]
+    step = old.extend(days_after(old, paths))
+    assert step.last['Deaths'] == step.last['Confirmed'] == old.last['Confirmed'] + 1
+    assert_same_store(step, build(paths))
+    # and on to the current files
+    assert_same_store(step.extend(days_after(step, data_files)), full)
+
+
+def test_unplaceable_frames_are_refused(tmp_path):
+    old = build([cut(f, tmp_path, 2) for f in data_files])
+    frames = days_after(old, data_files)
+    assert old.extend({}) is None
+    moved = frames['Confirmed'].copy()
+    moved.loc[0, 'Country'] = 'Atlantis'
+    assert old.extend({'Confirmed': moved}) is None
+    # a day the store already has for that metric is a revision, not an extension
+    loaded = read_merged(data_files[0], read_header(data_files[0])[-3:])
+    assert old.extend({'Confirmed': loaded}) is None
+
+
+def test_history_digest_ignores_appended_days(tmp_path):
+    short = cut(data_files[0], tmp_path, 3)
+    until = read_merged(short).columns[-1]
+    digest, new = read_history(short, until)
+    assert new == []
+    full_digest, new = read_history(data_files[0], until)
+    assert full_digest == digest
+    assert len(new) == 3
+
+
+def test_history_digest_sees_revisions(tmp_path):
+    revised = tmp_path / 'revised.csv'
+    with open(data_files[0], 'rb') as f:
+        lines = f.read().split(b'\n')
+    # one country's count on an early day
+    fields = lines[10].split(b',')
+    fields[-200] = str(int(fields[-200]) + 1).encode()
+    lines[10] = b','.join(fields)
+    revised.write_bytes(b'\n'.join(lines))
+    until = read_merged(data_files[0]).columns[-4]
+    assert read_history(str(revised), until)[0] != read_history(data_files[0], until)[0]
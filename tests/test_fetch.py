@@ -0,0 +1,105 @@
+import http.server
+import os
+import threading
+import pytest
+import fetch
+from fetch import fetch_all, load_state
+
+body = b'Country/Region,1/22/20\nUS,1\n'
+etag = '"v1"'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # /ok serves body with an ETag and answers 304 to it, /flaky fails with a 503
+    # first, /short promises more than it sends, anything else is a 404
+    hits = {}
+
+    def do_GET(self):
+        self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        if self.path == '/ok' and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+        elif self.path == '/ok' or (self.path == '/flaky' and self.hits[self.path] > 1):
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/flaky':
+            self.send_error(503)
+        elif self.path == '/short':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body) + 100))
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(fetch.time, 'sleep', lambda s: None)
+    Handler.hits = {}
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_then_not_modified(server, tmp_path):
+    path = str(tmp_path / 'a.csv')
+    state_file = str(tmp_path / 'state.json')
+    [r] = fetch_all([(server + '/ok', path)], state_file)
+    assert r['status'] == 'updated'
+    with open(path, 'rb') as f:
+        assert f.read() == body
+    assert load_state(state_file)[server + '/ok']['etag'] == etag
+
+    # the saved ETag is sent back and the copy on disk is kept
+    mtime = os.path.getmtime(path)
+    [r] = fetch_all([(server + '/ok', path)], state_file)
+    assert r['status'] == 'unchanged'
+    assert os.path.getmtime(path) == mtime
+    assert Handler.hits['/ok'] == 2
+
+
+def test_server_error_is_retried(server, tmp_path):
+    path = str(tmp_path / 'a.csv')
+    [r] = fetch_all([(server + '/flaky', path)], str(tmp_path / 'state.json'))
+    assert r['status'] == 'updated'
+    assert r['attempts'] == 2
+
+
+def test_client_error_is_not_retried(server, tmp_path):
+    path = str(tmp_path / 'a.csv')
+    state_file = str(tmp_path / 'state.json')
+    [r] = fetch_all([(server + '/missing', path)], state_file)
+    assert r['status'] == 'failed' and r['error'] == 'HTTP 404'
+    assert r['attempts'] == 1
+    assert not os.path.exists(path)
+    assert load_state(state_file) == {}
+
+
+def test_cut_short_body_keeps_the_old_copy(server, tmp_path):
+    path = tmp_path / 'a.csv'
+    path.write_bytes(b'old')
+    r = fetch.fetch(server + '/short', str(path), retries=2)
+    assert r['status'] == 'failed' and 'IncompleteRead' in r['error']
+    assert r['attempts'] == 2
+    assert path.read_bytes() == b'old'
+    # no partial file is left behind
+    assert os.listdir(tmp_path) == ['a.csv']
+
+
+def test_unreachable_host_fails(tmp_path):
+    # nothing listens on a port just given back by the OS
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    port = httpd.server_port
+    httpd.server_close()
+    r = fetch.fetch(f'http://127.0.0.1:{port}/ok', str(tmp_path / 'a.csv'), timeout=2, retries=1)
+    assert r['status'] == 'failed'
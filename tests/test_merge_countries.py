@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import root
+from data_functions import iso_date, merge_countries, read_merged
+
+data_files = [os.path.join(root, 'data', name) for name in ['time_series_covid19_confirmed_global.csv',
+                                                            'time_series_covid19_vaccine_doses_admin_global.csv',
+                                                            'time_series_covid19_deaths_global.csv']]
+
+
+# merge_countries and clean as the upstream baseline had them
+def baseline_clean(country, grp):
+    cnt = grp.get_group(country)
+    cnt_ = cnt.sum(axis=0)
+    cnt_['Country'] = country
+    return pd.DataFrame([cnt_.values], columns=cnt_.keys())
+
+
+def baseline_merge(df):
+    grp = df.groupby('Country')
+    vc = df['Country'].value_counts()
+    prov = list(vc[:list(vc > 1).index(False)].keys())
+    for country in prov:
+        cnt = baseline_clean(country, grp)
+        df = df[df['Country'] != country]
+        df = pd.concat([df, cnt], ignore_index=True)
+    return df
+
+
+def baseline_frame(path):
+    # the way the baseline read a file: drop the columns that are not dates, then merge
+    df = pd.read_csv(path)
+    df = df.rename(columns={'Country/Region': 'Country', 'Country_Region': 'Country'})
+    df = df[['Country'] + [col for col in df.columns if col[:1].isdigit()]]
+    df = baseline_merge(df).set_index('Country').sort_index()
+    return df.astype(np.float64)
+
+
+@pytest.fixture(scope='module', params=data_files, ids=os.path.basename)
+def source(request):
+    return request.param, baseline_frame(request.param)
+
+
+def test_merge_matches_baseline(source):
+    path, expected = source
+    # counts parsed without a dtype can come back as integers, only the values matter
+    df = merge_countries(pd.read_csv(path)).set_index('Country')
+    pd.testing.assert_frame_equal(df, expected, check_names=False, check_dtype=False)
+
+
+def test_chunked_merge_matches_baseline(source):
+    # countries whose provinces fall in different chunks are summed across them
+    path, expected = source
+    df = merge_countries(pd.read_csv(path, chunksize=97)).set_index('Country')
+    pd.testing.assert_frame_equal(df, expected, check_names=False, check_dtype=False)
+
+
+def test_read_merged_matches_baseline(source):
+    path, expected = source
+    expected.columns = [iso_date(x) for x in expected.columns]
+    df = read_merged(path, chunksize=113).set_index('Country')
+    pd.testing.assert_frame_equal(df, expected, check_names=False)